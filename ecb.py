@@ -4,25 +4,42 @@ import requests
 
 import ecb_certifi
 
+_INSTALLED = False
+_PROXIES: Dict[str, str] = {}
 
-def get_proxies() -> Dict[str, str]:
-    """Returns the proxy configuration for requests."""
+
+def _proxy_url() -> str:
     proxy_auth = 'ap-python-proxy:x2o7rCPYuN1JuV8H'
     proxy_url = 'p-gw.ecb.de:9090'
-    
     # Try explicit protocol in proxy URL
-    proxy_str = f'http://{proxy_auth}@{proxy_url}'
-    
+    return f'http://{proxy_auth}@{proxy_url}'
+
+
+def _install_env_once() -> None:
+    """Install the process-wide proxy/CA environment (runs only once)."""
+    global _INSTALLED
+    if _INSTALLED:
+        return
+    proxy_str = _proxy_url()
+
     # Additional environment variables that might help
     os.environ['no_proxy'] = ''
     os.environ['HTTP_PROXY'] = proxy_str
     os.environ['HTTPS_PROXY'] = proxy_str
     os.environ['REQUESTS_CA_BUNDLE'] = ecb_certifi.where()
-    
+
     # More aggressive SSL warning suppression
     requests.packages.urllib3.disable_warnings()
-    
-    return {
-        'http': proxy_str,
-        'https': proxy_str
-    }
+    _INSTALLED = True
+
+
+def get_proxies() -> Dict[str, str]:
+    """Returns the proxy configuration for requests (cached after the first call)."""
+    _install_env_once()
+    if not _PROXIES:
+        proxy_str = _proxy_url()
+        _PROXIES.update({
+            'http': proxy_str,
+            'https': proxy_str
+        })
+    return dict(_PROXIES)
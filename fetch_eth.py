@@ -1,14 +1,20 @@
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import polars as pl
 from datetime import datetime, timezone
 import time
 import os
-from pathlib import Path
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from utils.utils import (
     print_overall_transaction_dates,
-    load_index, save_index, update_index_with_file, is_block_in_index,
-    make_chunk_filename
+    load_index, save_index, update_index_with_file, covering_range,
+    append_index_journal, rebuild_index_from_directory,
+    append_parquet, make_chunk_filename
 )
 from ecb import get_proxies
 
@@ -19,28 +25,146 @@ TRANSACTIONS_DIR = 'transactions_usdt_eth_2025'
 INDEX_PATH = os.path.join(TRANSACTIONS_DIR, 'index.json')
 API_SLEEP_SECONDS = 0.25
 MAX_EMPTY_BATCHES = 3
+STORE_DATETIME = os.getenv('ETHERSCAN_STORE_DATETIME', '0') == '1'  # derive from timeStamp on read otherwise
+INDEX_SAVE_INTERVAL = 20  # consolidate index.json (and drop the journal) every N chunks
+LOOKAHEAD_BATCHES = int(os.getenv('ETHERSCAN_LOOKAHEAD', '4'))  # speculative batches kept in flight
+LOOKAHEAD_OVERLAP = 0.9  # guess spacing as a fraction of the last batch's block span
 BASE_URL_V2 = 'https://api.etherscan.io/v2/api'
+# Typed schema for tokentx rows. Etherscan returns every field as a string, so
+# frames are built as Utf8 (no dtype inference) and cast once. Addresses are
+# hex-decoded to Binary; repetitive token columns are Categorical so parquet
+# stores them dictionary-encoded.
+TX_SCHEMA = {
+    'blockNumber': pl.UInt32,  # ~23M today, 4.29B ceiling
+    'timeStamp': pl.UInt32,  # unix seconds, fits until 2106
+    'hash': pl.Utf8,
+    'nonce': pl.UInt32,
+    'blockHash': pl.Utf8,
+    'from': pl.Binary,  # 20 raw bytes instead of 42 hex chars
+    'contractAddress': pl.Binary,
+    'to': pl.Binary,
+    'value': pl.Utf8,  # uint256, does not fit any native integer
+    'tokenName': pl.Categorical,
+    'tokenSymbol': pl.Categorical,
+    'tokenDecimal': pl.UInt8,
+    'transactionIndex': pl.UInt32,
+    'gas': pl.UInt32,  # bounded by the block gas limit
+    'gasPrice': pl.UInt64,  # wei, routinely above 2**32
+    'gasUsed': pl.UInt32,
+    'cumulativeGasUsed': pl.UInt32,
+    'input': pl.Utf8,
+    'confirmations': pl.UInt32,
+}
+# Columns kept per chunk (ETHERSCAN_COLUMNS=all, or a comma list, to opt into more)
+REQUIRED_COLUMNS = ('blockNumber', 'timeStamp', 'hash')  # the fetch loop and index depend on these
+DEFAULT_COLUMNS = REQUIRED_COLUMNS + ('from', 'to', 'value', 'contractAddress')
 
 
+def _keep_columns(spec: str) -> tuple:
+    """Columns to keep for an ETHERSCAN_COLUMNS value, in schema order (required ones always)."""
+    spec = spec.strip()
+    if spec.lower() == 'all':
+        return tuple(TX_SCHEMA)
+    if not spec:
+        return DEFAULT_COLUMNS
+    requested = [c.strip() for c in spec.split(',') if c.strip()]
+    unknown = [c for c in requested if c not in TX_SCHEMA]
+    if unknown:
+        print(f"[WARN] ETHERSCAN_COLUMNS: ignoring unknown columns {unknown} (known: {', '.join(TX_SCHEMA)})")
+    wanted = set(requested) | set(REQUIRED_COLUMNS)
+    return tuple(c for c in TX_SCHEMA if c in wanted)
+
+
+KEEP_COLUMNS = _keep_columns(os.getenv('ETHERSCAN_COLUMNS', ''))
+_FRAME_SCHEMA = {name: TX_SCHEMA[name] for name in KEEP_COLUMNS}
+_RAW_SCHEMA = {name: pl.Utf8 for name in _FRAME_SCHEMA}
+
+# One pooled session for the whole run (keep-alive, no TLS handshake per call).
+# Transport errors and HTTP 429/5xx are retried by urllib3 with exponential backoff.
+_RETRY = Retry(
+    total=3,
+    backoff_factor=API_SLEEP_SECONDS,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=['GET'],
+    respect_retry_after_header=True,
+    backoff_jitter=0.25,  # de-synchronize concurrent look-ahead workers (urllib3 >= 2.0)
+    raise_on_status=False,  # hand the last response back so the JSON fallback can report it
+)
+_PROXIES = get_proxies()  # installs the proxy/CA environment once
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=_RETRY))
+_SESSION.headers['Accept-Encoding'] = 'gzip, deflate'  # compressed bodies, inflated by urllib3's zlib
+# Proxies and CA bundle are set explicitly, so skip the per-request env lookups
+_SESSION.trust_env = False
+_SESSION.verify = os.environ.get('REQUESTS_CA_BUNDLE', True)
+
+# Requests are issued from look-ahead worker threads; space them globally
+_THROTTLE_LOCK = threading.Lock()
+_next_request_at = 0.0
+
+
+def _throttle():
+    """Block until API_SLEEP_SECONDS have passed since the previous request start."""
+    global _next_request_at
+    with _THROTTLE_LOCK:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + API_SLEEP_SECONDS
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _retry_after_seconds(r) -> float | None:
+    """Seconds from a numeric Retry-After header, if the server sent one."""
+    try:
+        return max(0.0, float(r.headers['Retry-After']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
 def _etherscan_get(params: dict, max_retries: int = 3):
-    """Generic Etherscan V2 GET with minimal backoff."""
+    """Generic Etherscan V2 GET.
+
+    HTTP-level retries live in the session adapter; only Etherscan's JSON-level
+    rate limit message (served with HTTP 200) is retried here.
+    """
     attempt = 0
     while True:
-        r = requests.get(BASE_URL_V2, params=params, proxies=get_proxies(), timeout=30)
+        _throttle()
+        try:
+            r = _SESSION.get(BASE_URL_V2, params=params, proxies=_PROXIES, timeout=30)
+        except requests.RequestException as e:
+            return {'status': '0', 'result': f'Request failed: {e}'}
         try:
-            data = r.json()
-        except Exception:
-            data = {'status': '0', 'result': f'Non-JSON response: {r.text[:120]}'}
-        # Rate limit or transient signals
-        msg = (data.get('message') or '') + ' ' + str(data.get('result'))
-        if ('rate limit' in msg.lower() or 'too many' in msg.lower()) and attempt < max_retries:
-            sleep_for = API_SLEEP_SECONDS * (2 ** attempt)
+            data = orjson.loads(r.content)  # decodes bytes directly, no str round-trip
+        except orjson.JSONDecodeError:
+            data = {'status': '0', 'result': f"Non-JSON response: {r.content[:120].decode(errors='replace')}"}
+        if not isinstance(data, dict):
+            data = {'status': '0', 'result': f'Unexpected JSON payload: {str(data)[:120]}'}
+        msg = ((data.get('message') or '') + ' ' + str(data.get('result'))).lower()
+        if ('rate limit' in msg or 'too many' in msg) and attempt < max_retries:
+            sleep_for = _retry_after_seconds(r)
+            if sleep_for is None:
+                # Jittered so concurrent workers do not retry in lockstep
+                sleep_for = API_SLEEP_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
             print(f'[WARN] Rate limit, backing off {sleep_for:.2f}s (attempt {attempt+1}/{max_retries})')
             time.sleep(sleep_for)
             attempt += 1
             continue
         return data
 
+def _to_frame(result: list) -> pl.DataFrame:
+    """Build a typed frame of KEEP_COLUMNS from tokentx result dicts (no inference).
+
+    Keys outside the schema are never materialized as Series. Optional fields
+    the API leaves empty (or otherwise unparsable) become null; the required
+    columns stay strict, since the fetch loop cannot continue without them.
+    """
+    return pl.DataFrame(result, schema=_RAW_SCHEMA).with_columns(
+        pl.col(name).str.strip_prefix('0x').str.decode('hex') if dtype == pl.Binary
+        else pl.col(name).cast(dtype, strict=name in REQUIRED_COLUMNS)
+        for name, dtype in _FRAME_SCHEMA.items()
+    )
+
 def _fetch_latest_batch(token_address: str):
     # Use shared helper (still descending)
     params = {
@@ -57,7 +181,7 @@ def _fetch_latest_batch(token_address: str):
     result = data.get('result', [])
     if not result:
         raise RuntimeError('No transactions returned in initial batch.')
-    return pl.DataFrame(result)
+    return _to_frame(result)
 
 def _fetch_batch(token_address: str, end_block: int):
     """Fetch a descending batch ending at end_block (inclusive) via V2 API."""
@@ -74,7 +198,7 @@ def _fetch_batch(token_address: str, end_block: int):
     status = data.get('status')
     if status == '1':
         result = data.get('result', [])
-        return (pl.DataFrame(result) if result else pl.DataFrame(), data)
+        return (_to_frame(result) if result else pl.DataFrame(), data)
     # status == '0' could be genuine "No transactions found"
     result_field = str(data.get('result', '')).lower()
     if 'no transactions found' in result_field:
@@ -82,92 +206,54 @@ def _fetch_batch(token_address: str, end_block: int):
     # Return None to signal a hard API problem (handled upstream)
     return None, data
 
-def _parse_range_from_filename(fname: str):
-    """Parse HIGH_LOW from a filename like '23524414_23524246.csv'."""
-    if not fname:
-        return None
-    base = os.path.basename(fname)
-    stem = base.split('.')[0]
-    parts = stem.split('_')
-    if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
-        a, b = int(parts[0]), int(parts[1])
-        return max(a, b), min(a, b)
-    return None
-
-def _extract_range(entry):
-    """Return (high, low) tuple from a variety of possible index entry formats.
-
-    Supported:
-      - plain filename string "HIGH_LOW.csv"
-      - dict with keys: ('high','low') or ('max_block','min_block') etc.
-      - dict that only has 'file' / 'filename' (then parse)
+def _claim_batch(pending: dict, token_address: str, block: int):
+    """Return (df, meta) for a batch ending at block, preferring in-flight look-ahead.
+
+    pending maps endblock -> Future. The closest speculative batch ending at or
+    above block is usable when it reaches strictly below block (so block itself
+    is complete); it is then trimmed to blockNumber <= block. Every other
+    future at or above block is stale and cancelled.
     """
-    # String form
-    if isinstance(entry, str):
-        return _parse_range_from_filename(entry)
-
-    # Dict form
-    if isinstance(entry, dict):
-        high = low = None
-        for h_key in ('high', 'max_block', 'max', 'hi'):
-            if h_key in entry:
-                try:
-                    high = int(entry[h_key])
-                    break
-                except Exception:
-                    pass
-        for l_key in ('low', 'min_block', 'min', 'lo'):
-            if l_key in entry:
-                try:
-                    low = int(entry[l_key])
-                    break
-                except Exception:
-                    pass
-        if high is not None and low is not None:
-            return high, low
-        # Try filename fields
-        fname = entry.get('file') or entry.get('filename')
-        rng = _parse_range_from_filename(fname) if fname else None
-        if rng:
-            return rng
-    return None
-
-def _iter_index_entries(index_obj):
-    """Yield raw entries from various index container shapes."""
-    if not index_obj:
-        return
-    if isinstance(index_obj, list):
-        for e in index_obj:
-            yield e
-    elif isinstance(index_obj, dict):
-        # Common pattern: {'files': [...]} or some dict of file->meta
-        if 'files' in index_obj and isinstance(index_obj['files'], list):
-            for e in index_obj['files']:
-                yield e
-        else:
-            # Fall back to values
-            for e in index_obj.values():
-                yield e
-
-def _covering_range(block: int, index_obj) -> tuple[int, int] | None:
-    """Return (high, low) of a range covering block, else None."""
-    for entry in _iter_index_entries(index_obj):
-        rng = _extract_range(entry)
-        if not rng:
-            continue
-        hi, lo = rng
-        if lo <= block <= hi:
-            return hi, lo
-    return None
+    above = sorted(e for e in pending if e >= block)
+    futures = [pending.pop(e) for e in above]
+    for fut in futures[1:]:
+        fut.cancel()
+    if futures:
+        end = above[0]
+        df, meta = futures[0].result()
+        if end == block:
+            return df, meta
+        if df is not None and not df.is_empty():
+            if df.select(pl.col('blockNumber').min()).item() < block:
+                print(f'[DEBUG] Using look-ahead batch ending at {end} for block {block}')
+                return df.filter(pl.col('blockNumber') <= block), meta
+    return _fetch_batch(token_address, block)
+
+def _speculate(pending: dict, executor: ThreadPoolExecutor, token_address: str,
+               next_block: int, span: int):
+    """Top up in-flight batches below next_block, spaced by the last batch span."""
+    step = max(1, int(span * LOOKAHEAD_OVERLAP))
+    if not any(e >= next_block for e in pending):
+        pending[next_block] = executor.submit(_fetch_batch, token_address, next_block)
+    while len(pending) < LOOKAHEAD_BATCHES:
+        end = min(pending) - step
+        if end < 0:
+            break
+        pending[end] = executor.submit(_fetch_batch, token_address, end)
 
 def fetch_and_save_transactions(token_address: str, start_date: str):
     """Backward fetch from latest block down to start_date (inclusive).
 
     start_date: YYYY-MM-DD (oldest date boundary). We stop once all older txs excluded.
-    Chunk files named {high}_{low}.csv with descending coverage.
+    Chunk files named {high}_{low}.parquet with descending coverage.
     """
     os.makedirs(TRANSACTIONS_DIR, exist_ok=True)
     index = load_index(INDEX_PATH)
+    if not index['files']:
+        # Missing/unreadable index: chunk names alone are enough to recover coverage
+        index = rebuild_index_from_directory(TRANSACTIONS_DIR, base=index)
+        if index['files']:
+            print(f"[INFO] Rebuilt index from {len(index['files'])} chunk files")
     start_ts = int(datetime.strptime(start_date, '%Y-%m-%d').timestamp())
 
     print('[INFO] Starting fetch')
@@ -179,8 +265,9 @@ def fetch_and_save_transactions(token_address: str, start_date: str):
         print(f'[ERROR] {e}')
         return
 
-    newest_block = int(latest_df['blockNumber'].max())
-    newest_ts = int(latest_df['timeStamp'].max())
+    newest_block, newest_ts = latest_df.select(
+        pl.col('blockNumber').max(), pl.col('timeStamp').max()
+    ).row(0)
     print(f'[DEBUG] Newest block {newest_block} newest timestamp {newest_ts}')
 
     print('Coverage before:')
@@ -190,76 +277,96 @@ def fetch_and_save_transactions(token_address: str, start_date: str):
     empty_batches = 0
     written = 0
     oldest_ts_seen = newest_ts  # track oldest timestamp reached in this run
+    executor = ThreadPoolExecutor(max_workers=max(1, LOOKAHEAD_BATCHES))
+    pending = {}  # endblock -> Future of _fetch_batch
 
-    while True:
-        covering = _covering_range(current_block, index)
-        if covering:
-            hi, lo = covering
-            next_block = lo - 1
-            if next_block < 0:
-                print('[INFO] Reached block < 0, stopping.')
-                break
-            print(f'[INFO] Block {current_block} lies in existing range {hi}->{lo}; skipping to {next_block}')
-            current_block = next_block
-            # Check if we still need more (timestamp boundary handled later)
-            continue
+    try:
+        while True:
+            covering = covering_range(current_block, index)
+            if covering:
+                hi, lo = covering
+                next_block = lo - 1
+                if next_block < 0:
+                    print('[INFO] Reached block < 0, stopping.')
+                    break
+                print(f'[INFO] Block {current_block} lies in existing range {hi}->{lo}; skipping to {next_block}')
+                current_block = next_block
+                # Check if we still need more (timestamp boundary handled later)
+                continue
 
-        df, meta = _fetch_batch(token_address, current_block)
-        if df is None:  # hard error
-            print(f"[WARN] API error at block {current_block}: {meta.get('result')} Retrying once after sleep.")
-            time.sleep(API_SLEEP_SECONDS * 5)
-            df, meta = _fetch_batch(token_address, current_block)
-            if df is None:
-                print('[ERROR] Persistent API failure, aborting.')
-                break
-        if df.is_empty():
-            empty_batches += 1
-            if empty_batches >= MAX_EMPTY_BATCHES:
-                print('[INFO] Max empty batches -> stopping.')
-                break
-            current_block -= 1
-            continue
+            df, meta = _claim_batch(pending, token_address, current_block)
+            if df is None:  # hard error
+                print(f"[WARN] API error at block {current_block}: {meta.get('result')} Retrying once after sleep.")
+                time.sleep(API_SLEEP_SECONDS * 5)
+                df, meta = _fetch_batch(token_address, current_block)
+                if df is None:
+                    print('[ERROR] Persistent API failure, aborting.')
+                    break
+            if df.is_empty():
+                empty_batches += 1
+                if empty_batches >= MAX_EMPTY_BATCHES:
+                    print('[INFO] Max empty batches -> stopping.')
+                    break
+                current_block -= 1
+                continue
 
-        lowest_block = int(df['blockNumber'].min())
-        oldest_ts_batch = int(df['timeStamp'].min())
+            lowest_block, oldest_ts_batch, newest_ts_file = df.select(
+                pl.col('blockNumber').min(),
+                pl.col('timeStamp').min().alias('ts_min'),
+                pl.col('timeStamp').max().alias('ts_max'),
+            ).row(0)
+            if oldest_ts_batch >= start_ts:
+                # Queue the next batches now so their RTT overlaps trimming + writing.
+                # Pacing is handled by _throttle inside _etherscan_get.
+                _speculate(pending, executor, token_address, lowest_block - 1,
+                           current_block - lowest_block + 1)
 
-        # Date trimming
-        if oldest_ts_batch < start_ts:
-            df = df.filter(pl.col('timeStamp') >= start_ts)
-            if df.is_empty():
-                print('[INFO] Batch entirely below boundary; stopping.')
-                break
-            lowest_block = int(df['blockNumber'].min())
+            # Date trimming (+ optional stored datetime) planned as one lazy pass
+            lf = df.lazy()
+            if oldest_ts_batch < start_ts:
+                lf = lf.filter(pl.col('timeStamp') >= start_ts)
+            if STORE_DATETIME:
+                lf = lf.with_columns(pl.from_epoch('timeStamp', time_unit='s').alias('datetime'))
+            df = lf.collect()
+            oldest_ts_file = oldest_ts_batch
+            if oldest_ts_batch < start_ts:
+                if df.height == 0:
+                    print('[INFO] Batch entirely below boundary; stopping.')
+                    break
+                lowest_block, oldest_ts_file = df.select(
+                    pl.col('blockNumber').min(), pl.col('timeStamp').min()
+                ).row(0)
 
-        # Add datetime at end (avoid duplicate computation for trimmed set)
-        df = df.with_columns(pl.from_epoch('timeStamp', time_unit='s').alias('datetime'))
+            filename = make_chunk_filename(current_block, lowest_block)
+            try:
+                append_parquet(df, TRANSACTIONS_DIR, current_block, lowest_block)
+                index = update_index_with_file(index, filename, oldest_ts_file, newest_ts_file)
+                # Journal only; the full index is rewritten once when the run ends
+                append_index_journal(INDEX_PATH, filename, current_block, lowest_block,
+                                     oldest_ts_file, newest_ts_file)
+                written += 1
+                if written % INDEX_SAVE_INTERVAL == 0:
+                    save_index(INDEX_PATH, index)
+                print(f'[DEBUG] Wrote {filename} rows={df.height} blocks {current_block}->{lowest_block}')
+                # Progress every 10 chunks
+                if oldest_ts_file < oldest_ts_seen:
+                    oldest_ts_seen = oldest_ts_file
+                if written % 10 == 0:
+                    progress_dt = datetime.fromtimestamp(oldest_ts_seen, tz=timezone.utc)
+                    print(f'[PROGRESS] After {written} chunks oldest timestamp so far: '
+                          f'{progress_dt.isoformat()} (block {lowest_block})')
+            except Exception as e:
+                print(f'[ERROR] Could not write {filename}: {e}')
+                break
 
-        filename = make_chunk_filename(current_block, lowest_block)
-        out_path = Path(TRANSACTIONS_DIR) / filename
-        try:
-            df.write_csv(out_path)
-            index = update_index_with_file(index, filename)
-            # No need to recompute entire structure; skip as extraction is resilient.
+            current_block = lowest_block - 1
+            if oldest_ts_batch < start_ts:
+                print('[INFO] Reached boundary timestamp; stopping.')
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if written:
             save_index(INDEX_PATH, index)
-            written += 1
-            print(f'[DEBUG] Wrote {filename} rows={df.height} blocks {current_block}->{lowest_block}')
-            # Progress every 10 chunks
-            oldest_ts_file = int(df['timeStamp'].min())
-            if oldest_ts_file < oldest_ts_seen:
-                oldest_ts_seen = oldest_ts_file
-            if written % 10 == 0:
-                progress_dt = datetime.fromtimestamp(oldest_ts_seen, tz=timezone.utc)
-                print(f'[PROGRESS] After {written} chunks oldest timestamp so far: '
-                      f'{progress_dt.isoformat()} (block {lowest_block})')
-        except Exception as e:
-            print(f'[ERROR] Could not write {filename}: {e}')
-            break
-
-        current_block = lowest_block - 1
-        if oldest_ts_batch < start_ts:
-            print('[INFO] Reached boundary timestamp; stopping.')
-            break
-        time.sleep(API_SLEEP_SECONDS)
 
     print(f'[INFO] Fetch finished. Chunks written: {written}')
     print('Coverage after:')
@@ -2,12 +2,14 @@
 # Simple backward collection via offset until reaching start_date boundary.
 
 import os
-import json
+import calendar
 import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Set
+from typing import Dict, Any, List, Set, Optional, Tuple
 from dotenv import load_dotenv
-from datetime import timedelta  # add after imports
+import orjson
 from pathlib import Path
 
 from ecb import get_proxies
@@ -24,15 +26,28 @@ USDT_CONTRACT = 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'
 OUT_DIR = 'transactions_tron'
 BLOCK_DIR = os.path.join(OUT_DIR, 'blocks')
 RESUME_FILE = os.path.join(OUT_DIR, 'resume.json')
-PAGE_LIMIT = int(os.getenv('TRON_PAGE_LIMIT', '50'))
+PAGE_LIMIT = int(os.getenv('TRON_PAGE_LIMIT', '50'))  # largest page requested (TronScan caps it at 50)
+PAGE_LIMIT_MIN = min(PAGE_LIMIT, int(os.getenv('TRON_PAGE_LIMIT_MIN', '10')))  # first page size of a slice; floor after failures
 WINDOW_MODE = os.getenv('TRON_WINDOW_MODE', 'month')  # 'month' or hours
 START_DATE = os.getenv('TRON_START_DATE', '2024-01-01')
 DEBUG = os.getenv('TRON_DEBUG', '1') == '1'
-SLEEP_PAGE = float(os.getenv('TRON_SLEEP_PAGE', '0.10'))
 DUP_PAGES_BREAK = int(os.getenv('TRON_DUP_PAGES_BREAK', '3'))  # consecutive duplicate pages to break window early
 DATA_SOURCE = os.getenv('DATA_SOURCE', 'transfers')  # 'transfers' or 'transactions'
 MAX_PAGES_PER_WINDOW = int(os.getenv('TRON_MAX_PAGES_PER_WINDOW', '4000'))  # hard cap to prevent extremely long windows
 SUBWINDOW_DAYS = int(os.getenv('TRON_SUBWINDOW_DAYS', '0'))  # if >0 split each month window into day-sized backward slices
+PREFETCH_PAGES = max(1, int(os.getenv('TRON_PREFETCH_PAGES', '4')))  # pages kept in flight per slice
+FLUSH_RECORDS = int(os.getenv('TRON_FLUSH_RECORDS', '2000'))  # buffered records before a block-file flush
+SEEN_CACHE_BLOCKS = int(os.getenv('TRON_SEEN_CACHE_BLOCKS', '4096'))  # LRU bound on cached per-block tid sets
+
+RESUME_SAVE_SECONDS = float(os.getenv('TRON_RESUME_SAVE_SECONDS', '5'))  # min interval between resume writes
+
+_last_resume_save = 0.0  # monotonic time of the last resume write
+# block -> ((size, mtime_ns) of its file when last read/written, stored transaction ids);
+# the dedupe source of truth, re-read only when the file changed behind our back
+_SEEN: 'OrderedDict[int, Tuple[Optional[Tuple[int, int]], Set[str]]]' = OrderedDict()
+# Blocks with lines still in the pending buffer: their _SEEN entry holds ids the file
+# does not have yet, so it is never evicted (a reload would forget them) until flushed
+_PINNED: Set[int] = set()
 
 
 def _ensure():
@@ -43,83 +58,189 @@ def _ensure():
 def _load_resume() -> Dict[str, Any]:
     if os.path.exists(RESUME_FILE):
         try:
-            with open(RESUME_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(RESUME_FILE, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception:
             return {}
     return {}
 
 
-def _save_resume(state: Dict[str, Any]):
+def _save_resume(state: Dict[str, Any], force: bool = False):
+    """Atomically rewrite the resume file, at most every RESUME_SAVE_SECONDS unless forced."""
+    global _last_resume_save
+    now = time.monotonic()
+    if not force and now - _last_resume_save < RESUME_SAVE_SECONDS:
+        return
     state['updated'] = datetime.utcnow().isoformat() + 'Z'
-    with open(RESUME_FILE, 'w', encoding='utf-8') as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    tmp = RESUME_FILE + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, RESUME_FILE)
+    _last_resume_save = now
 
 
-def _write_block_records(block: int, records: List[Dict[str, Any]]):
-    """Store ALL raw transfer objects for a block (append + dedupe by transaction_id)."""
-    if block is None or not records:
-        return
-    path = os.path.join(BLOCK_DIR, f"{block}.json")
-    existing: List[Dict[str, Any]] = []
+def _record_id(r: Dict[str, Any]) -> Any:
+    return r.get('transaction_id') or r.get('hash')
+
+
+def _block_path(block: int) -> str:
+    return os.path.join(BLOCK_DIR, f"{block}.ndjson")
+
+
+def _load_block_seen(block: int) -> Set[str]:
+    """Return transaction ids already stored for block (one streaming pass).
+
+    Migrates a legacy {block}.json array to NDJSON on first touch and drops a
+    torn trailing line left by an interrupted append.
+    """
+    path = _block_path(block)
+    legacy = os.path.join(BLOCK_DIR, f"{block}.json")
+    if not os.path.exists(path) and os.path.exists(legacy):
+        try:
+            with open(legacy, 'rb') as f:
+                old = orjson.loads(f.read()) or []
+            with open(path, 'wb') as f:
+                f.write(b''.join(orjson.dumps(r) + b'\n' for r in old))
+            os.remove(legacy)
+        except Exception:
+            pass
     seen: Set[str] = set()
-    if os.path.exists(path):
+    if not os.path.exists(path):
+        return seen
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            cut = data.rfind(b'\n') + 1
+            f.truncate(cut)
+            data = data[:cut]
+    for line in data.splitlines():
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                existing = json.load(f) or []
-            for r in existing:
-                tid = r.get('transaction_id') or r.get('hash')
-                if tid:
-                    seen.add(tid)
+            tid = _record_id(orjson.loads(line))
         except Exception:
-            existing = []
-            seen = set()
-    appended = 0
-    for r in records:
-        tid = r.get('transaction_id') or r.get('hash')
-        if tid and tid in seen:
             continue
-        existing.append(r)
         if tid:
             seen.add(tid)
-        appended += 1
-    if appended:
-        # keep newest first
-        existing.sort(key=lambda x: x.get('block_ts', x.get('timestamp', x.get('time', 0))), reverse=True)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(existing, f, ensure_ascii=False, separators=(',', ':'))
+    return seen
+
+
+def _file_sig(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _seen_for(block: int) -> Set[str]:
+    """Cached tid set for block (LRU-evicted).
+
+    A stat is the only I/O on a hit; the file is re-parsed only on first touch
+    or when its size/mtime no longer match what this process last saw.
+    """
+    cached = _SEEN.get(block)
+    if cached is not None and cached[0] == _file_sig(_block_path(block)):
+        _SEEN.move_to_end(block)
+        return cached[1]
+    seen = _load_block_seen(block)
+    if cached is not None and block in _PINNED:
+        seen |= cached[1]  # file changed behind our back: keep the still-buffered ids
+    _SEEN[block] = (_file_sig(_block_path(block)), seen)
+    _SEEN.move_to_end(block)
+    for _ in range(len(_SEEN) - SEEN_CACHE_BLOCKS):
+        victim = next((b for b in _SEEN if b not in _PINNED), None)
+        if victim is None:
+            break  # everything cached is pinned; shrinks again after the next flush
+        del _SEEN[victim]
+    return seen
+
+
+def _take_new_records(block: int, records: List[Dict[str, Any]]) -> List[bytes]:
+    """Encode the records of block not stored yet, marking them seen.
+
+    Dedupes by transaction_id against the cached _SEEN[block]; the returned
+    NDJSON lines are buffered by the caller and written by _flush_pending.
+    """
+    if block is None or not records:
+        return []
+    seen = _seen_for(block)
+    lines: List[bytes] = []
+    # Locals bound once: this loop runs for every fetched record
+    seen_add, lines_append, dumps = seen.add, lines.append, orjson.dumps
+    for r in records:
+        tid = r.get('transaction_id') or r.get('hash')
+        if not tid:
+            lines_append(dumps(r))
+        elif tid not in seen:
+            lines_append(dumps(r))
+            seen_add(tid)
+    if lines:
+        _PINNED.add(block)
+    return lines
+
+
+def _flush_pending(pending: Dict[int, List[bytes]]) -> int:
+    """Append buffered lines to blocks/{block}.ndjson (one open per block) and clear the buffer."""
+    written = 0
+    for block, lines in pending.items():
+        with open(_block_path(block), 'ab') as f:
+            f.write(b'\n'.join(lines) + b'\n')
+            f.flush()
+            st = os.fstat(f.fileno())
+        cached = _SEEN.get(block)
+        if cached is not None:  # our own append: keep the cached set valid
+            _SEEN[block] = ((st.st_size, st.st_mtime_ns), cached[1])
+        written += len(lines)
+        _PINNED.discard(block)
+    pending.clear()
+    return written
+
+
+def _record_ts(r: Dict[str, Any]) -> Any:
+    return r.get('block_ts', r.get('timestamp', r.get('time', 0)))
+
+
+def _finalize_blocks(blocks: Set[int]) -> None:
+    """Sort each touched block file newest-first, once, after the harvest.
+
+    Appends during the run are unordered; ordering is cosmetic, so it is
+    applied here instead of on every write.
+    """
+    for block in sorted(blocks):
+        path = _block_path(block)
+        try:
+            with open(path, 'rb') as f:
+                records = [orjson.loads(line) for line in f.read().splitlines() if line]
+        except (OSError, orjson.JSONDecodeError):
+            continue
+        records.sort(key=_record_ts, reverse=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(orjson.dumps(r) + b'\n' for r in records))
+        os.replace(tmp, path)
+    if DEBUG and blocks:
+        print(f"[DEBUG][TRONSCAN] finalized (sorted) {len(blocks)} block files")
+
+
+def _month_start_ms(month_idx: int) -> int:
+    """UTC epoch ms of the first day of month_idx (year*12 + month-1)."""
+    year, month0 = divmod(month_idx, 12)
+    return calendar.timegm((year, month0 + 1, 1, 0, 0, 0)) * 1000
 
 
 def _month_windows(start_dt: datetime, end_dt: datetime) -> List[tuple[int,int]]:
     """Return list of (start_ms,end_ms) month windows newest->oldest covering [start_dt,end_dt]."""
-    windows: List[tuple[int,int]] = []
-    # move to first day next month after end_dt
-    cur = datetime(end_dt.year, end_dt.month, 1, tzinfo=timezone.utc)
-    # ensure cur covers end_dt
-    if cur <= end_dt:
-        # advance one month
-        if cur.month == 12:
-            cur = datetime(cur.year+1, 1, 1, tzinfo=timezone.utc)
-        else:
-            cur = datetime(cur.year, cur.month+1, 1, tzinfo=timezone.utc)
-    while True:
-        next_month = cur
-        # previous month start
-        if cur.month == 1:
-            prev_start = datetime(cur.year-1, 12, 1, tzinfo=timezone.utc)
-        else:
-            prev_start = datetime(cur.year, cur.month-1, 1, tzinfo=timezone.utc)
-        window_start = prev_start
-        window_end = next_month - timedelta(milliseconds=1)
-        if window_end < start_dt:
-            break
-        ws_ms = int(max(window_start, start_dt).timestamp()*1000)
-        we_ms = int(min(window_end, end_dt).timestamp()*1000)
-        windows.append((ws_ms, we_ms))
-        cur = prev_start
-        if window_start <= start_dt:
-            break
-    return windows
+    start_ms = int(start_dt.timestamp() * 1000)
+    end_ms = int(end_dt.timestamp() * 1000)
+    first = start_dt.year * 12 + start_dt.month - 1
+    last = end_dt.year * 12 + end_dt.month - 1
+    return [
+        (max(_month_start_ms(m), start_ms), min(_month_start_ms(m + 1) - 1, end_ms))
+        for m in range(last, first - 1, -1)
+    ]
+
+
+def _iso_ms(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
 
 
 def _scan_existing_blocks() -> Set[int]:
@@ -127,7 +248,9 @@ def _scan_existing_blocks() -> Set[int]:
     p = Path(BLOCK_DIR)
     if not p.exists():
         return blocks
-    for f in p.glob('*.json'):
+    for f in p.iterdir():
+        if f.suffix not in ('.ndjson', '.json'):  # .json = legacy array format
+            continue
         try:
             b = int(f.stem)
             blocks.add(b)
@@ -136,6 +259,12 @@ def _scan_existing_blocks() -> Set[int]:
     return blocks
 
 
+def _fetch_page(s_start: int, s_end: int, offset: int, limit: int) -> List[Dict[str, Any]]:
+    if DATA_SOURCE == 'transfers':
+        return fetch_trc20_transfers_page(USDT_CONTRACT, s_start, s_end, offset=offset, limit=limit, debug=DEBUG)
+    return fetch_transactions_page_window(USDT_CONTRACT, s_start, s_end, offset=offset, limit=limit, debug=DEBUG)
+
+
 def harvest_simple(start_date: str = START_DATE):
     _ensure()
     boundary_dt = datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
@@ -153,120 +282,155 @@ def harvest_simple(start_date: str = START_DATE):
     page_offset = resume.get('page_offset', 0)
     total_saved = resume.get('total_saved', 0)  # counts newly appended tx
     existing_blocks: Set[int] = _scan_existing_blocks()  # still used for stats but not for skipping
+    touched_blocks: Set[int] = set()  # blocks appended to this run, sorted by _finalize_blocks
+    # block -> encoded new records, written at FLUSH_RECORDS or slice end; the resume
+    # checkpoint is only saved right after a flush so it never runs ahead of the disk
+    pending: Dict[int, List[bytes]] = {}
+    pending_count = 0
     if DEBUG:
         print(f"[DEBUG][TRONSCAN] existing_blocks_loaded={len(existing_blocks)}")
 
-    while win_index < len(windows):
-        ws_ms, we_ms = windows[win_index]
-        if SUBWINDOW_DAYS > 0:
-            # produce subwindows newest->older within the month window
-            day_ms = 86400000 * SUBWINDOW_DAYS
-            sub_end = we_ms
-            subwindows: List[tuple[int,int]] = []
-            while sub_end >= ws_ms:
-                sub_start = max(ws_ms, sub_end - day_ms + 1)
-                subwindows.append((sub_start, sub_end))
-                sub_end = sub_start - 1
-        else:
-            subwindows = [(ws_ms, we_ms)]
-        if DEBUG:
-            print(f'[DEBUG][TRONSCAN] Window idx={win_index} slices={len(subwindows)} start={datetime.fromtimestamp(ws_ms/1000, tz=timezone.utc).isoformat()} end={datetime.fromtimestamp(we_ms/1000, tz=timezone.utc).isoformat()} start_offset={page_offset}')
-        for slice_idx, (s_start, s_end) in enumerate(subwindows):
-            pages_in_slice = 0
-            if DEBUG and len(subwindows) > 1:
-                print(f'[DEBUG][TRONSCAN]  Slice {slice_idx+1}/{len(subwindows)} {datetime.fromtimestamp(s_start/1000, tz=timezone.utc).isoformat()} -> {datetime.fromtimestamp(s_end/1000, tz=timezone.utc).isoformat()} offset_start={page_offset}')
-            while True:
-                if DATA_SOURCE == 'transfers':
-                    page_raw = fetch_trc20_transfers_page(USDT_CONTRACT, s_start, s_end, offset=page_offset, limit=PAGE_LIMIT, debug=DEBUG)
-                else:
-                    page_raw = fetch_transactions_page_window(USDT_CONTRACT, s_start, s_end, offset=page_offset, limit=PAGE_LIMIT, debug=DEBUG)
-                if not page_raw:
-                    page_offset = 0
-                    break
-                pages_in_slice += 1
-                retrieval_ts = int(time.time())
-                for rr in page_raw:
-                    rr['retrieved_at'] = retrieval_ts
-                norm = normalize_trc20_transfers(page_raw) if DATA_SOURCE == 'transfers' else normalize_transactions(page_raw)
-                if not norm:
-                    page_offset += PAGE_LIMIT
-                    time.sleep(SLEEP_PAGE)
-                    continue
-                per_block: Dict[int, List[Dict[str, Any]]] = {}
-                for raw_r in page_raw:
-                    blk = raw_r.get('block') or raw_r.get('blockNumber')
+    pool = ThreadPoolExecutor(max_workers=PREFETCH_PAGES)
+    try:
+        while win_index < len(windows):
+            ws_ms, we_ms = windows[win_index]
+            if SUBWINDOW_DAYS > 0:
+                # produce subwindows newest->older within the month window
+                day_ms = 86400000 * SUBWINDOW_DAYS
+                sub_end = we_ms
+                subwindows: List[tuple[int,int]] = []
+                while sub_end >= ws_ms:
+                    sub_start = max(ws_ms, sub_end - day_ms + 1)
+                    subwindows.append((sub_start, sub_end))
+                    sub_end = sub_start - 1
+            else:
+                subwindows = [(ws_ms, we_ms)]
+            if DEBUG:
+                # Window/slice labels are formatted once here, never in the page loop
+                print(f'[DEBUG][TRONSCAN] Window idx={win_index} slices={len(subwindows)} start={_iso_ms(ws_ms)} end={_iso_ms(we_ms)} start_offset={page_offset}')
+                show_slices = len(subwindows) > 1
+            for slice_idx, (s_start, s_end) in enumerate(subwindows):
+                pages_in_slice = 0
+                if DEBUG and show_slices:
+                    print(f'[DEBUG][TRONSCAN]  Slice {slice_idx+1}/{len(subwindows)} {_iso_ms(s_start)} -> {_iso_ms(s_end)} offset_start={page_offset}')
+                # Pages are fetched PREFETCH_PAGES ahead but consumed strictly in offset order.
+                # The page size starts at PAGE_LIMIT_MIN and doubles after every full page up
+                # to PAGE_LIMIT. A failure (an exception, or nothing after a full page, which
+                # is how exhausted retries surface) halves it and re-requests that offset once;
+                # duplicates never change it. Each in-flight entry keeps its requested limit.
+                inflight = deque()
+                next_offset = page_offset
+                cur_limit = PAGE_LIMIT_MIN
+                retried_offset = None  # offset already re-requested after a failure
+                while True:
+                    while len(inflight) < PREFETCH_PAGES:
+                        inflight.append((cur_limit, pool.submit(_fetch_page, s_start, s_end, next_offset, cur_limit)))
+                        next_offset += cur_limit
+                    page_limit, fut = inflight.popleft()
                     try:
-                        blk_i = int(blk)
-                    except Exception:
+                        page_raw = fut.result()
+                        failed = not page_raw and pages_in_slice > 0
+                    except Exception as e:
+                        if retried_offset == page_offset:
+                            raise
+                        print(f"[WARN][TRONSCAN] page fetch failed off={page_offset} limit={page_limit}: {e}")
+                        page_raw, failed = [], True
+                    if failed and retried_offset != page_offset:
+                        retried_offset = page_offset
+                        cur_limit = max(page_limit // 2, PAGE_LIMIT_MIN)
+                        for _, stale in inflight:  # offsets downstream of the retried page
+                            stale.cancel()
+                        inflight.clear()
+                        next_offset = page_offset
+                        continue
+                    if not page_raw:
+                        page_offset = 0
+                        break
+                    pages_in_slice += 1
+                    if len(page_raw) >= page_limit:
+                        cur_limit = min(cur_limit * 2, PAGE_LIMIT)
+                    retrieval_ts = int(time.time())
+                    for rr in page_raw:
+                        rr['retrieved_at'] = retrieval_ts
+                    norm = normalize_trc20_transfers(page_raw) if DATA_SOURCE == 'transfers' else normalize_transactions(page_raw)
+                    if not norm:
+                        page_offset += page_limit
                         continue
-                    per_block.setdefault(blk_i, []).append(raw_r)
-                new_block_count = 0
-                new_tx_count = 0
-                for blk_num, recs in per_block.items():
-                    before_len = 0
-                    path_blk = os.path.join(BLOCK_DIR, f"{blk_num}.json")
-                    if os.path.exists(path_blk):
+                    per_block: Dict[int, List[Dict[str, Any]]] = {}
+                    for raw_r in page_raw:
+                        blk = raw_r.get('block') or raw_r.get('blockNumber')
                         try:
-                            with open(path_blk, 'r', encoding='utf-8') as f:
-                                before_len = len(json.load(f) or [])
+                            blk_i = int(blk)
                         except Exception:
-                            before_len = 0
-                    _write_block_records(blk_num, recs)
-                    existing_blocks.add(blk_num)
-                    try:
-                        with open(path_blk, 'r', encoding='utf-8') as f:
-                            after_len = len(json.load(f) or [])
-                        appended_here = max(after_len - before_len, 0)
-                        new_tx_count += appended_here
-                        if appended_here > 0:
+                            continue
+                        per_block.setdefault(blk_i, []).append(raw_r)
+                    new_block_count = 0
+                    new_tx_count = 0
+                    for blk_num, recs in per_block.items():
+                        new_lines = _take_new_records(blk_num, recs)
+                        existing_blocks.add(blk_num)
+                        if new_lines:
+                            pending.setdefault(blk_num, []).extend(new_lines)
+                            new_tx_count += len(new_lines)
                             new_block_count += 1
-                    except Exception:
-                        pass
-                total_saved += new_tx_count
-                if DEBUG:
-                    print(f"[DEBUG][TRONSCAN] win={win_index} slice={slice_idx} off={page_offset} new_blocks_with_additions={new_block_count} new_tx={new_tx_count} total_tx_added={total_saved} pages_in_slice={pages_in_slice}")
-                # Duplicate page detection (no new tx appended)
-                if new_tx_count == 0:
-                    dup_counter = resume.get('dup_counter', 0) + 1
-                else:
-                    dup_counter = 0
-                resume['dup_counter'] = dup_counter
-                if dup_counter >= DUP_PAGES_BREAK:
-                    if DEBUG:
-                        print(f"[DEBUG][TRONSCAN] breaking slice early after {dup_counter} duplicate pages (win={win_index} slice={slice_idx})")
-                    page_offset = 0
-                    break
-                if pages_in_slice >= MAX_PAGES_PER_WINDOW:
+                            touched_blocks.add(blk_num)
+                    pending_count += new_tx_count
+                    total_saved += new_tx_count
                     if DEBUG:
-                        print(f"[WARN][TRONSCAN] MAX_PAGES_PER_WINDOW reached ({MAX_PAGES_PER_WINDOW}) win={win_index} slice={slice_idx}; moving on.")
-                    page_offset = 0
-                    break
-                if len(page_raw) < PAGE_LIMIT:
-                    page_offset = 0
-                    break
-                page_offset += PAGE_LIMIT
-                resume.update({
-                    'win_index': win_index,
-                    'page_offset': page_offset,
-                    'total_saved': total_saved,
-                    'dup_counter': dup_counter,
-                    'existing_blocks': len(existing_blocks),
-                    'data_source': DATA_SOURCE,
-                    'pages_in_slice': pages_in_slice
-                })
-                _save_resume(resume)
-                time.sleep(SLEEP_PAGE)
-            page_offset = 0  # reset for next slice
-        win_index += 1
-        resume.update({
-            'win_index': win_index,
-            'page_offset': page_offset,
-            'total_saved': total_saved,
-            'dup_counter': resume.get('dup_counter', 0),
-            'existing_blocks': len(existing_blocks),
-            'data_source': DATA_SOURCE
-        })
-        _save_resume(resume)
+                        print(f"[DEBUG][TRONSCAN] win={win_index} slice={slice_idx} off={page_offset} new_blocks_with_additions={new_block_count} new_tx={new_tx_count} total_tx_added={total_saved} pages_in_slice={pages_in_slice}")
+                    # Duplicate page detection (no new tx appended)
+                    if new_tx_count == 0:
+                        dup_counter = resume.get('dup_counter', 0) + 1
+                    else:
+                        dup_counter = 0
+                    resume['dup_counter'] = dup_counter
+                    if dup_counter >= DUP_PAGES_BREAK:
+                        if DEBUG:
+                            print(f"[DEBUG][TRONSCAN] breaking slice early after {dup_counter} duplicate pages (win={win_index} slice={slice_idx})")
+                        page_offset = 0
+                        break
+                    if pages_in_slice >= MAX_PAGES_PER_WINDOW:
+                        if DEBUG:
+                            print(f"[WARN][TRONSCAN] MAX_PAGES_PER_WINDOW reached ({MAX_PAGES_PER_WINDOW}) win={win_index} slice={slice_idx}; moving on.")
+                        page_offset = 0
+                        break
+                    if len(page_raw) < page_limit:
+                        page_offset = 0
+                        break
+                    page_offset += page_limit
+                    resume.update({
+                        'win_index': win_index,
+                        'page_offset': page_offset,
+                        'total_saved': total_saved,
+                        'dup_counter': dup_counter,
+                        'existing_blocks': len(existing_blocks),
+                        'data_source': DATA_SOURCE,
+                        'pages_in_slice': pages_in_slice
+                    })
+                    if pending_count >= FLUSH_RECORDS:
+                        _flush_pending(pending)
+                        pending_count = 0
+                        _save_resume(resume)
+                for _, fut in inflight:  # look-ahead past the end of the slice
+                    fut.cancel()
+                _flush_pending(pending)
+                pending_count = 0
+                page_offset = 0  # reset for next slice
+            win_index += 1
+            resume.update({
+                'win_index': win_index,
+                'page_offset': page_offset,
+                'total_saved': total_saved,
+                'dup_counter': resume.get('dup_counter', 0),
+                'existing_blocks': len(existing_blocks),
+                'data_source': DATA_SOURCE
+            })
+            _save_resume(resume, force=True)
+        _finalize_blocks(touched_blocks)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _flush_pending(pending)  # deduped records are valid even if the run was interrupted
+        _save_resume(resume, force=True)
     print(f'[INFO][TRONSCAN] Harvest complete total_new_tx_appended={total_saved} blocks_dir={BLOCK_DIR}')
 
 
@@ -11,10 +11,8 @@ def merge_csv_files(directory_path, output_file):
         output_file (str): Path where the merged CSV file will be saved
     """
     # List all CSV files in the directory by filtering for .csv extension
-    csv_files = [f for f in os.listdir(directory_path) if f.endswith('.csv')]
-
-    # Initialize an empty list to store individual DataFrames
-    dataframes = []
+    with os.scandir(directory_path) as it:
+        csv_files = [e.name for e in it if e.name.endswith('.csv') and e.is_file()]
 
     # Define the standard column order to ensure consistency across all files
     standard_columns = [
@@ -40,30 +38,41 @@ def merge_csv_files(directory_path, output_file):
         'datetime'              # Human-readable datetime
     ]
 
-    # Process each CSV file and add it to the dataframes list
+    if not csv_files:
+        print("No CSV files found to merge.")
+        return
+
+    # Fixed dtypes for the numeric columns; everything else (including the dedupe key
+    # columns, value being a uint256) is read as text so nothing is type-guessed.
+    numeric_types = {
+        'blockNumber': pl.UInt64, 'timeStamp': pl.Int64, 'nonce': pl.UInt64,
+        'tokenDecimal': pl.UInt8, 'transactionIndex': pl.UInt32, 'gas': pl.UInt64,
+        'gasPrice': pl.UInt64, 'gasUsed': pl.UInt64, 'cumulativeGasUsed': pl.UInt64,
+        'confirmations': pl.UInt64,
+    }
+    schema = {col: numeric_types.get(col, pl.Utf8) for col in standard_columns}
+
+    # Build one lazy plan over all files: each file is projected onto the standard
+    # column order, the union is deduplicated, and the result is streamed to disk
+    # without materializing every DataFrame in memory.
+    scans = []
     for file in csv_files:
         print(f'Processing {file}')
         file_path = os.path.join(directory_path, file)
-        # Read the CSV file into a Polars DataFrame
-        df = pl.read_csv(file_path)
-        
-        # Ensure all columns are in the standard order
-        df = df.select(standard_columns)
-        dataframes.append(df)
-
-    # Merge all DataFrames if any exist
-    if dataframes:
-        # Concatenate all DataFrames vertically
-        merged_df = pl.concat(dataframes)
+        scans.append(
+            pl.scan_csv(file_path, schema_overrides=schema, low_memory=True).select(standard_columns)
+        )
 
-        # Remove any duplicate transactions that might exist across files
-        merged_df = merged_df.unique()
+    # Remove any duplicate transfers that might exist across files. A transaction
+    # hash alone is not unique (one tx can emit several token transfers), so the
+    # key is the hash plus the transfer's endpoints and amount instead of every column.
+    merged = pl.concat(scans, how='vertical').unique(
+        subset=['hash', 'from', 'to', 'value'], keep='first', maintain_order=False
+    )
 
-        # Save the final merged DataFrame to CSV
-        merged_df.write_csv(output_file)
-        print(f"Merged data successfully written to {output_file}")
-    else:
-        print("No CSV files found to merge.")
+    # Stream the final merged result to CSV
+    merged.sink_csv(output_file)
+    print(f"Merged data successfully written to {output_file}")
 
 
 # Execute the merge function with default paths
@@ -1,50 +1,177 @@
 from pathlib import Path
 import polars as pl
 from utils.utils import (
-    parse_block_range_from_filename,
+    parse_block_range_from_filename, iter_chunk_names, scan_chunk, binary_to_hex,
     load_index, save_index, update_index_with_file, mark_files_merged,
-    append_dataframe
+    merged_file_set, append_parquet, make_chunk_filename
 )
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 TRANSACTIONS_DIR = 'transactions_eth'
 INDEX_PATH = os.path.join(TRANSACTIONS_DIR, 'index.json')
-MERGED_FILE = 'transactions_eth.csv'
-BATCH_SAVE_INTERVAL = 100  # save after this many source chunks processed
+MERGED_DIR = 'transactions_eth_merged'  # one zstd Parquet part per merged batch
+MERGED_FILE = 'transactions_eth.csv'  # optional CSV export of MERGED_DIR
+EXPORT_CSV = os.environ.get('MERGE_EXPORT_CSV') == '1'
+FORCE_EXPORT = os.environ.get('MERGE_EXPORT_FORCE') == '1'  # overwrite MERGED_FILE even if not migrated
+# Present in MERGED_DIR once MERGED_FILE's pre-Parquet rows live in a part (or there were none)
+MIGRATED_MARKER = '.csv_migrated'
+BATCH_SAVE_INTERVAL = 100  # chunks per streamed batch; index is saved after each batch
 
-STANDARD_COLUMNS = [
-    'blockNumber', 'timeStamp', 'hash', 'nonce', 'blockHash',
-    'from', 'to', 'contractAddress', 'value', 'tokenName',
-    'tokenSymbol', 'tokenDecimal', 'transactionIndex', 'gas',
-    'gasPrice', 'gasUsed', 'cumulativeGasUsed', 'input',
-    'confirmations', 'datetime'
-]
+# Output schema of every merged part; each chunk is cast to it in the scan plan so
+# parts share one schema and batches concatenate without type reconciliation.
+STANDARD_SCHEMA = {
+    'blockNumber': pl.UInt64, 'timeStamp': pl.Int64, 'hash': pl.Utf8,
+    'nonce': pl.UInt64, 'blockHash': pl.Utf8, 'from': pl.Utf8, 'to': pl.Utf8,
+    'contractAddress': pl.Utf8, 'value': pl.Utf8, 'tokenName': pl.Utf8,
+    'tokenSymbol': pl.Utf8, 'tokenDecimal': pl.UInt8, 'transactionIndex': pl.UInt32,
+    'gas': pl.UInt64, 'gasPrice': pl.UInt64, 'gasUsed': pl.UInt64,
+    'cumulativeGasUsed': pl.UInt64, 'input': pl.Utf8, 'confirmations': pl.UInt64,
+    'datetime': pl.Datetime('us'),
+}
+STANDARD_COLUMNS = list(STANDARD_SCHEMA)
+# Chunks may be written with a pruned column set (see ETHERSCAN_COLUMNS in
+# fetch_eth.py); only these are mandatory, the rest are filled with nulls.
+REQUIRED_COLUMNS = ['blockNumber', 'timeStamp', 'hash']
 
 def _iter_new_chunk_files(directory: Path, index: dict) -> list:
-    """Return list of (high, low, Path) for chunk CSVs not yet marked merged."""
-    merged_files = set(index.get('merged', {}).get('files', []))
+    """Return list of (high, low, Path) for chunk files not yet marked merged."""
+    merged_files = merged_file_set(index)
     candidates = []
-    for f in directory.glob('*.csv'):
-        if f.name == MERGED_FILE:
+    for name in iter_chunk_names(directory):
+        if name == MERGED_FILE or name in merged_files:
             continue
-        if f.name in merged_files:
-            continue
-        high, low = parse_block_range_from_filename(f.name)
+        high, low = parse_block_range_from_filename(name)
         if high is None:
             continue
-        candidates.append((high, low, f))
+        candidates.append((high, low, directory / name))
     # Sort descending by high so newest first (optional)
     candidates.sort(reverse=True)
     return candidates
 
-def merge_csv_files(directory_path, output_file):
+def _scan_standard(file: Path) -> pl.LazyFrame | None:
+    """Lazy plan projecting one chunk onto STANDARD_COLUMNS, or None if unusable."""
+    return _standardize(binary_to_hex(scan_chunk(file)), file.name)
+
+def _standardize(lf: pl.LazyFrame, name: str) -> pl.LazyFrame | None:
+    names = lf.collect_schema().names()
+    missing = set(REQUIRED_COLUMNS) - set(names)
+    if missing:
+        print(f"[WARN] Skipping {name}, missing columns: {missing}")
+        return None
+    if 'datetime' not in names:
+        # Fetcher stores only timeStamp by default
+        lf = lf.with_columns(pl.from_epoch('timeStamp', time_unit='s').alias('datetime'))
+        names.append('datetime')
+    elif lf.collect_schema()['datetime'] == pl.Utf8:
+        # Legacy CSV chunks carry datetime as text
+        lf = lf.with_columns(pl.col('datetime').str.to_datetime(time_unit='us', strict=False))
+    present = set(names)
+    return lf.select(
+        pl.col(c).cast(dtype) if c in present else pl.lit(None, dtype=dtype).alias(c)
+        for c, dtype in STANDARD_SCHEMA.items()
+    )
+
+def _collect_batch(batch: list) -> tuple:
+    """Collect one batch of (high, low, Path) chunks into a single frame.
+
+    Returns (df | None, merged file names).
+    """
+    frames, batch_files = [], []
+    for high, low, file in batch:
+        try:
+            lf = _scan_standard(file)
+        except Exception as e:
+            print(f"[ERROR] Failed processing {file.name}: {e}")
+            continue
+        if lf is not None:
+            frames.append(lf)
+            batch_files.append(file.name)
+    if not frames:
+        return None, batch_files
+    try:
+        return pl.concat(frames, how='vertical').collect(), batch_files
+    except Exception as e:
+        # One bad/truncated chunk fails the whole plan: isolate it so the rest
+        # of the batch still merges (the bad file stays unmerged and is retried)
+        print(f"[WARN] Batch starting at {batch[0][2].name} failed ({e}); retrying its files one by one")
+    good, good_files = [], []
+    for lf, name in zip(frames, batch_files):
+        try:
+            good.append(lf.collect())
+            good_files.append(name)
+        except Exception as e:
+            print(f"[ERROR] Failed merging {name}: {e}")
+    if not good:
+        return None, []
+    return pl.concat(good, how='vertical'), good_files
+
+def migrate_legacy_csv(output_dir, csv_file) -> None:
+    """Convert a pre-Parquet merged CSV into the first part of output_dir.
+
+    Chunks merged by CSV-era runs are already marked merged in the index, so
+    their rows exist only in csv_file; without this they would be missing from
+    the parts (and from any later CSV export). Runs once, guarded by MIGRATED_MARKER.
+    """
+    output = Path(output_dir); csv_file = Path(csv_file)
+    marker = output / MIGRATED_MARKER
+    if marker.exists():
+        return
+    output.mkdir(parents=True, exist_ok=True)
+    if csv_file.exists():
+        if any(output.glob('*.parquet')):
+            # Parts written before this migration existed: csv_file may be an
+            # export of them or legacy data; refuse to guess either way
+            print(f"[WARN] {csv_file.name} exists next to unmigrated parts in {output}; not converting it. "
+                  f"Move it into a part by hand, or touch {marker} if it only holds exported parts.")
+            return
+        # Every column as text (uint256 values defeat type inference), cast by the plan
+        lf = _standardize(pl.scan_csv(csv_file, infer_schema=False), csv_file.name)
+        if lf is None:
+            print(f"[WARN] {csv_file.name} is not a merged export; leaving it untouched.")
+            return
+        high, low = lf.select(pl.col('blockNumber').max().alias('high'), pl.col('blockNumber').min().alias('low')).collect().row(0)
+        if high is not None:
+            path = output / make_chunk_filename(high, low)
+            tmp = path.with_name(path.name + '.tmp')
+            lf.sink_parquet(tmp, compression='zstd', compression_level=3, statistics=True)
+            os.replace(tmp, path)
+            print(f"[INFO] Migrated {csv_file.name} into merged part {path.name}")
+    marker.touch()
+
+def export_merged_csv(output_dir, csv_file, force: bool = False):
+    """Stream every merged Parquet part into a single CSV (back-compat export).
+
+    An existing csv_file is only replaced once its rows are known to be in the
+    parts (MIGRATED_MARKER), unless force is set. Written via a temp file so an
+    interrupted export leaves the previous CSV intact.
+    """
+    output = Path(output_dir); csv_file = Path(csv_file)
+    if csv_file.exists() and not force and not (output / MIGRATED_MARKER).exists():
+        print(f"[ERROR] Refusing to overwrite {csv_file}: it may hold rows missing from {output}. "
+              f"Run the merge to migrate it, or set MERGE_EXPORT_FORCE=1.")
+        return
+    parts = sorted(output.glob('*.parquet'), reverse=True)
+    if not parts:
+        print("No merged parts to export.")
+        return
+    tmp = csv_file.with_name(csv_file.name + '.tmp')
+    pl.scan_parquet(parts).select(STANDARD_COLUMNS).sink_csv(tmp)
+    os.replace(tmp, csv_file)
+    print(f"[INFO] Exported {len(parts)} merged parts to {csv_file}")
+
+def merge_csv_files(directory_path, output_dir, csv_file=None):
+    """Merge unmerged chunks into Parquet parts; csv_file is the legacy merged CSV to migrate."""
     directory = Path(directory_path)
-    output = Path(output_file)
+    output = Path(output_dir)
+    csv_file = Path(csv_file) if csv_file is not None else output.parent / MERGED_FILE
 
     print(f"[DEBUG] Directory: {directory}")
     if not directory.exists():
         raise FileNotFoundError(f"Directory {directory_path} does not exist")
 
+    migrate_legacy_csv(output, csv_file)
+
     index = load_index(INDEX_PATH)
     print(f"[DEBUG] Loaded index (merged files count={len(index.get('merged', {}).get('files', []))})")
 
@@ -54,37 +181,34 @@ def merge_csv_files(directory_path, output_file):
         return
     print(f"[DEBUG] {len(new_chunks)} new chunk files pending merge.")
 
-    processed_files = []
     total_rows_appended = 0
+    batches = [new_chunks[i:i + BATCH_SAVE_INTERVAL] for i in range(0, len(new_chunks), BATCH_SAVE_INTERVAL)]
 
-    for i, (high, low, file) in enumerate(new_chunks, start=1):
-        try:
-            print(f"[DEBUG] ({i}/{len(new_chunks)}) Reading {file.name} blocks {high}->{low}")
-            df = pl.read_csv(file)
-            missing = set(STANDARD_COLUMNS) - set(df.columns)
-            if missing:
-                print(f"[WARN] Skipping {file.name}, missing columns: {missing}")
+    # Stream BATCH_SAVE_INTERVAL chunks at a time through one lazy plan; only the
+    # current batch (plus the one being prefetched) is ever materialized, and the
+    # index is saved after each append. Polars already parallelizes the scan of a
+    # batch, so a single background worker is enough to overlap reading batch N+1
+    # with writing batch N; appends stay serial and in order.
+    done = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(_collect_batch, batches[0])
+        for i, batch in enumerate(batches):
+            df, batch_files = pending.result()
+            if i + 1 < len(batches):
+                pending = pool.submit(_collect_batch, batches[i + 1])
+            done += len(batch)
+            print(f"[DEBUG] ({done}/{len(new_chunks)}) Merged blocks {batch[0][0]}->{batch[-1][1]}")
+            if df is None:
                 continue
-            df = df.select(STANDARD_COLUMNS)
-            append_dataframe(df, output, column_order=STANDARD_COLUMNS)
+            spans = [(h, l) for h, l, f in batch if f.name in batch_files]
+            append_parquet(df, output, max(h for h, _ in spans), min(l for _, l in spans))
             total_rows_appended += df.height
-            processed_files.append(file.name)
-            # Update per-file coverage index
-            index = update_index_with_file(index, file.name)
-        except Exception as e:
-            print(f"[ERROR] Failed processing {file.name}: {e}")
-            continue
-
-        if i % BATCH_SAVE_INTERVAL == 0:
-            index = mark_files_merged(index, processed_files)
+            for name in batch_files:
+                # Update per-file coverage index
+                index = update_index_with_file(index, name)
+            index = mark_files_merged(index, batch_files)
             save_index(INDEX_PATH, index)
-            processed_files.clear()
-            print(f"[DEBUG] Intermediate save after {i} files, total rows appended so far {total_rows_appended}")
-
-    # Final save of any remaining processed files
-    if processed_files:
-        index = mark_files_merged(index, processed_files)
-        save_index(INDEX_PATH, index)
+            print(f"[DEBUG] Saved after {done} files, total rows appended so far {total_rows_appended}")
 
     print(f"[INFO] Merge complete. Total new rows appended: {total_rows_appended}")
 
@@ -94,7 +218,10 @@ if __name__ == "__main__":
         print(f'[DEBUG] Script directory: {script_dir}')
         merge_csv_files(
             script_dir / TRANSACTIONS_DIR,
+            script_dir / MERGED_DIR,
             script_dir / MERGED_FILE
         )
+        if EXPORT_CSV:
+            export_merged_csv(script_dir / MERGED_DIR, script_dir / MERGED_FILE, force=FORCE_EXPORT)
     except Exception as e:
         print(f"Error: {e}")
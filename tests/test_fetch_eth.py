@@ -0,0 +1,121 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# fetch_eth installs the corporate proxy/CA environment at import; keep tests off it
+sys.modules.setdefault('ecb', types.SimpleNamespace(get_proxies=lambda: {}))
+
+import fetch_eth  # noqa: E402
+from utils.utils import _empty_index, load_index, make_chunk_filename, save_index, update_index_with_file  # noqa: E402
+
+DAY = 86400
+T0 = int(datetime(2024, 12, 29, tzinfo=timezone.utc).timestamp())
+
+
+def _row(block: int) -> dict:
+    row = {name: '0' for name in fetch_eth.TX_SCHEMA}
+    row.update(
+        blockNumber=str(block),
+        timeStamp=str(T0 + (block - 91) * DAY // 2),
+        hash=f'0x{block:064x}',
+        blockHash=f'0x{block:064x}',
+        value='1000000',
+        input='0x',
+        tokenName='Tether USD',
+        tokenSymbol='USDT',
+        tokenDecimal='6',
+    )
+    for name in ('from', 'to', 'contractAddress'):
+        row[name] = '0x' + f'{block:02x}' * 20
+    return row
+
+
+def _fake_api(params: dict) -> dict:
+    """tokentx for blocks 100..91, half a day apart, newest first."""
+    end = int(params.get('endblock', 100))
+    return {'status': '1', 'message': 'OK', 'result': [_row(b) for b in range(min(end, 100), 90, -1)]}
+
+
+class KeepColumnsTest(unittest.TestCase):
+    def test_required_columns_are_always_kept(self):
+        with mock.patch('builtins.print'):
+            self.assertEqual(fetch_eth._keep_columns('value'), ('blockNumber', 'timeStamp', 'hash', 'value'))
+
+    def test_unknown_columns_warn(self):
+        with mock.patch('builtins.print') as out:
+            cols = fetch_eth._keep_columns('bogus, gasUsed')
+        self.assertEqual(cols, ('blockNumber', 'timeStamp', 'hash', 'gasUsed'))
+        self.assertIn("['bogus']", out.call_args.args[0])
+
+    def test_defaults_and_all(self):
+        self.assertEqual(fetch_eth._keep_columns(''), fetch_eth.DEFAULT_COLUMNS)
+        self.assertEqual(fetch_eth._keep_columns('ALL'), tuple(fetch_eth.TX_SCHEMA))
+
+
+class ToFrameTest(unittest.TestCase):
+    def test_empty_optional_fields_become_null(self):
+        row = _row(95)
+        row.update(nonce='', gas='', gasPrice='', gasUsed='', cumulativeGasUsed='', confirmations='')
+        frame_schema = dict(fetch_eth.TX_SCHEMA)
+        with mock.patch.object(fetch_eth, '_FRAME_SCHEMA', frame_schema), \
+                mock.patch.object(fetch_eth, '_RAW_SCHEMA', {n: pl.Utf8 for n in frame_schema}):
+            df = fetch_eth._to_frame([row, _row(94)])
+        self.assertEqual(df['blockNumber'].to_list(), [95, 94])
+        for name in ('nonce', 'gas', 'gasPrice', 'gasUsed', 'cumulativeGasUsed', 'confirmations'):
+            self.assertEqual(df[name].to_list(), [None, 0], name)
+            self.assertEqual(df[name].dtype, fetch_eth.TX_SCHEMA[name])
+
+
+class FetchAndSaveTest(unittest.TestCase):
+    def test_one_batch_is_written_and_indexed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'index.json')
+            with mock.patch.object(fetch_eth, 'TRANSACTIONS_DIR', tmp), \
+                    mock.patch.object(fetch_eth, 'INDEX_PATH', index_path), \
+                    mock.patch.object(fetch_eth, '_etherscan_get', side_effect=_fake_api):
+                fetch_eth.fetch_and_save_transactions('0xdac17f958d2ee523a2206206994597c13d831ec7', '2025-01-01')
+            index = load_index(index_path)
+        self.assertEqual(len(index['files']), 1)
+        (name, entry), = index['files'].items()
+        start_ts = int(datetime.strptime('2025-01-01', '%Y-%m-%d').timestamp())
+        self.assertTrue(name.startswith('100_'))
+        self.assertEqual(entry['high'], 100)
+        self.assertGreaterEqual(entry['ts_min'], start_ts)
+        self.assertEqual(entry['ts_max'], T0 + 9 * DAY // 2)
+
+    def test_indexed_runs_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'index.json')
+            index = _empty_index()
+            for high, low in ((100, 97), (96, 95)):
+                index = update_index_with_file(index, make_chunk_filename(high, low))
+            save_index(index_path, index)
+            with mock.patch.object(fetch_eth, 'TRANSACTIONS_DIR', tmp), \
+                    mock.patch.object(fetch_eth, 'INDEX_PATH', index_path), \
+                    mock.patch.object(fetch_eth, '_etherscan_get', side_effect=_fake_api) as api:
+                fetch_eth.fetch_and_save_transactions('0xdac17f958d2ee523a2206206994597c13d831ec7', '2024-12-28')
+        end_blocks = [c.args[0].get('endblock') for c in api.call_args_list]
+        self.assertEqual(end_blocks[:2], [None, 94])  # latest batch, then past both chunks at once
+
+    def test_write_failure_reports_the_chunk_being_written(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'index.json')
+            with mock.patch.object(fetch_eth, 'TRANSACTIONS_DIR', tmp), \
+                    mock.patch.object(fetch_eth, 'INDEX_PATH', index_path), \
+                    mock.patch.object(fetch_eth, '_etherscan_get', side_effect=_fake_api), \
+                    mock.patch.object(fetch_eth, 'append_parquet', side_effect=OSError('disk full')), \
+                    mock.patch('builtins.print') as out:
+                fetch_eth.fetch_and_save_transactions('0xdac17f958d2ee523a2206206994597c13d831ec7', '2025-01-01')
+        lines = [' '.join(map(str, c.args)) for c in out.call_args_list]
+        self.assertIn('[ERROR] Could not write 100_97.parquet: disk full', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
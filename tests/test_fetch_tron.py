@@ -0,0 +1,110 @@
+import os
+import sys
+import tempfile
+import time
+import types
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.modules.setdefault('ecb', types.SimpleNamespace(get_proxies=lambda: {}))
+
+import orjson  # noqa: E402
+
+import fetch_tron  # noqa: E402
+
+NOW_MS = int(time.time() * 1000)
+
+
+def _records(n: int) -> list:
+    return [{'transaction_id': f't{i}', 'block': 1000 + i // 5, 'block_ts': NOW_MS - i * 1000, 'quant': '1'}
+            for i in range(n)]
+
+
+class HarvestTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        out = tmp.name
+        self.block_dir = os.path.join(out, 'blocks')
+        patches = [
+            mock.patch.object(fetch_tron, 'OUT_DIR', out),
+            mock.patch.object(fetch_tron, 'BLOCK_DIR', self.block_dir),
+            mock.patch.object(fetch_tron, 'RESUME_FILE', os.path.join(out, 'resume.json')),
+            mock.patch.object(fetch_tron, 'PREFETCH_PAGES', 1),
+            mock.patch.object(fetch_tron, 'PAGE_LIMIT', 50),
+            mock.patch.object(fetch_tron, 'PAGE_LIMIT_MIN', 10),
+            mock.patch.object(fetch_tron, 'DATA_SOURCE', 'transfers'),
+            mock.patch.object(fetch_tron, 'DEBUG', False),
+            mock.patch.object(fetch_tron, 'set_external_proxies'),
+            mock.patch.object(fetch_tron, '_SEEN', fetch_tron.OrderedDict()),
+            mock.patch('builtins.print'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _harvest(self, data, fail_once_at=None):
+        calls = []
+        failed = set()
+
+        def fake_page(s_start, s_end, offset, limit):
+            calls.append((offset, limit))
+            if offset == fail_once_at and offset not in failed:
+                failed.add(offset)
+                raise TimeoutError('read timed out')
+            return [dict(r) for r in data[offset:offset + limit]]
+
+        month_start = datetime.now(timezone.utc).strftime('%Y-%m-01')
+        with mock.patch.object(fetch_tron, '_fetch_page', side_effect=fake_page):
+            fetch_tron.harvest_simple(month_start)
+        stored = set()
+        for name in os.listdir(self.block_dir):
+            with open(os.path.join(self.block_dir, name), 'rb') as f:
+                stored.update(orjson.loads(line)['transaction_id'] for line in f.read().splitlines())
+        return calls, stored
+
+    def test_page_size_grows_from_the_floor(self):
+        data = _records(95)
+        calls, stored = self._harvest(data)
+        self.assertEqual(calls, [(0, 10), (10, 20), (30, 40), (70, 50)])
+        self.assertEqual(stored, {r['transaction_id'] for r in data})
+
+    def test_failure_halves_and_retries_the_same_offset(self):
+        data = _records(95)
+        calls, stored = self._harvest(data, fail_once_at=30)
+        self.assertEqual(calls, [(0, 10), (10, 20), (30, 40), (30, 20), (50, 40), (90, 50)])
+        self.assertEqual(stored, {r['transaction_id'] for r in data})
+
+
+class SeenCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, 'blocks'))
+        patches = [
+            mock.patch.object(fetch_tron, 'BLOCK_DIR', os.path.join(tmp.name, 'blocks')),
+            mock.patch.object(fetch_tron, 'SEEN_CACHE_BLOCKS', 2),
+            mock.patch.object(fetch_tron, '_SEEN', fetch_tron.OrderedDict()),
+            mock.patch.object(fetch_tron, '_PINNED', set()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_buffered_block_is_not_evicted_before_flush(self):
+        pending = {}
+        for block in (1, 2, 3, 4):  # block 1's lines stay buffered while the LRU overflows
+            pending[block] = fetch_tron._take_new_records(block, [{'transaction_id': f'b{block}'}])
+        self.assertIn(1, fetch_tron._SEEN)
+        self.assertEqual(fetch_tron._take_new_records(1, [{'transaction_id': 'b1'}]), [])
+        fetch_tron._flush_pending(pending)
+        with open(fetch_tron._block_path(1), 'rb') as f:
+            self.assertEqual(f.read().count(b'\n'), 1)
+        fetch_tron._take_new_records(5, [{'transaction_id': 'b5'}])
+        self.assertLessEqual(len(fetch_tron._SEEN), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import merge_eth  # noqa: E402
+from utils.utils import append_parquet  # noqa: E402
+
+BIG_VALUE = str(2 ** 200)  # uint256 amounts do not fit any native integer
+
+
+def _chunk(blocks) -> pl.DataFrame:
+    return pl.DataFrame({
+        'blockNumber': [int(b) for b in blocks],
+        'timeStamp': [1_735_689_600 + int(b) for b in blocks],
+        'hash': [f'0x{b:064x}' for b in blocks],
+        'value': ['1'] * len(blocks),
+    })
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.chunks = self.root / 'transactions_eth'
+        self.chunks.mkdir()
+        self.out = self.root / merge_eth.MERGED_DIR
+        self.csv = self.root / merge_eth.MERGED_FILE
+        patcher = mock.patch.object(merge_eth, 'INDEX_PATH', str(self.chunks / 'index.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _merge(self):
+        with mock.patch('builtins.print'):
+            merge_eth.merge_csv_files(self.chunks, self.out, self.csv)
+
+    def test_legacy_csv_survives_the_switch_to_parts(self):
+        # CSV-era output: header as written by the old merger, datetime as text
+        self.csv.write_text(
+            'blockNumber,timeStamp,hash,value,datetime\n'
+            f'10,1700000010,0xaa,{BIG_VALUE},2023-11-14T22:13:30\n'
+            '9,1700000009,0xbb,5,2023-11-14T22:13:29\n'
+        )
+        append_parquet(_chunk([21, 20]), self.chunks, 21, 20)
+        self._merge()
+        with mock.patch('builtins.print'):
+            merge_eth.export_merged_csv(self.out, self.csv)
+        exported = pl.read_csv(self.csv, infer_schema=False)
+        self.assertEqual(sorted(exported['blockNumber'].cast(pl.Int64)), [9, 10, 20, 21])
+        self.assertIn(BIG_VALUE, exported['value'].to_list())
+        self.assertEqual(list(self.root.glob('*.tmp')), [])
+
+    def test_export_refuses_to_replace_an_unmigrated_csv(self):
+        self.csv.write_text('blockNumber,timeStamp,hash\n1,2,0x1\n')
+        self.out.mkdir()
+        _chunk([5]).write_parquet(self.out / '5_5.parquet')
+        with mock.patch('builtins.print'):
+            merge_eth.export_merged_csv(self.out, self.csv)
+        self.assertEqual(self.csv.read_text(), 'blockNumber,timeStamp,hash\n1,2,0x1\n')
+
+    def test_bad_chunk_does_not_block_its_batch(self):
+        append_parquet(_chunk([30, 29]), self.chunks, 30, 29)
+        append_parquet(_chunk([28]), self.chunks, 28, 28)
+        # Reads a schema fine but cannot be cast, so it only fails when collected
+        (self.chunks / '27_26.csv').write_text('blockNumber,timeStamp,hash\n27,1,0x1\ncorrupt,2,0x2\n')
+        self._merge()
+        index = merge_eth.load_index(merge_eth.INDEX_PATH)
+        self.assertEqual(set(index['merged']['files']), {'30_29.parquet', '28_28.parquet'})
+        merged = pl.read_parquet(list(self.out.glob('*.parquet')))
+        self.assertEqual(sorted(merged['blockNumber']), [28, 29, 30])
+
+
+if __name__ == '__main__':
+    unittest.main()
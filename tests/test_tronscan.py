@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import tronscan  # noqa: E402
+
+CONFIRMED = {'hash': 'a1', 'confirmed': True, 'contractRet': 'SUCCESS',
+             'cost': {'fee': 345000, 'energy_usage_total': 14650}}
+PENDING = {'hash': 'b2', 'confirmed': False, 'contractRet': 'SUCCESS'}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        tronscan._RESP_CACHE.clear()
+
+    def _get(self, reply):
+        with mock.patch.object(tronscan, '_get_single', return_value=reply) as single:
+            tronscan._get('/api/transaction-info', {'hash': reply['hash']})
+            tronscan._get('/api/transaction-info', {'hash': reply['hash']})
+        return single.call_count
+
+    def test_confirmed_reply_is_cached(self):
+        self.assertEqual(self._get(dict(CONFIRMED)), 1)
+
+    def test_pending_reply_is_not_cached(self):
+        self.assertEqual(self._get(dict(PENDING)), 2)
+
+    def test_hits_are_copies(self):
+        with mock.patch.object(tronscan, '_get_single', return_value={'data': [{'id': 1}]}):
+            first = tronscan._get('/api/token_trc20/transfers', {'start': 0})
+        first['data'][0]['retrieved_at'] = 123
+        second = tronscan._get('/api/token_trc20/transfers', {'start': 0})
+        self.assertEqual(second, {'data': [{'id': 1}]})
+
+    def test_pending_cost_record(self):
+        self.assertEqual(tronscan._cost_record('b2', PENDING), {'hash': 'b2', 'cost_pending': 1})
+        self.assertEqual(tronscan._cost_record('a1', CONFIRMED)['fee_trx'], 0.345)
+
+
+class _Reply:
+    def __init__(self, status, body=None, headers=None):
+        self.status_code = status
+        self._body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self._body
+
+
+class ConditionalGetTest(unittest.TestCase):
+    def setUp(self):
+        tronscan._VALIDATORS.clear()
+
+    def test_304_is_served_from_a_copy_of_the_stored_body(self):
+        replies = [_Reply(200, {'data': [{'id': 1}]}, {'ETag': '"v1"'}), _Reply(304)]
+        with mock.patch.object(tronscan, '_http_get', side_effect=replies) as http, \
+                mock.patch.object(tronscan, '_throttle'):
+            kw = dict(timeout=5, retries=0, backoff=0, debug=False)
+            first = tronscan._get_single('https://x', '/api/p', {'a': 1}, **kw)
+            first['data'][0]['retrieved_at'] = 123
+            second = tronscan._get_single('https://x', '/api/p', {'a': 1}, **kw)
+        self.assertEqual(http.call_args_list[1].args[3], {'If-None-Match': '"v1"'})
+        self.assertEqual(second, {'data': [{'id': 1}]})
+
+
+class BatchProbeTest(unittest.TestCase):
+    def setUp(self):
+        tronscan._batch_supported = None
+        tronscan._RESP_CACHE.clear()
+        tronscan._VALIDATORS.clear()
+        self.calls = []
+        patches = [
+            mock.patch.object(tronscan, '_cached_costs', return_value={}),
+            mock.patch.object(tronscan, '_store_costs'),
+            mock.patch.object(tronscan, '_throttle'),
+            mock.patch.object(tronscan, 'TRONSCAN_BASES', ['https://x']),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(setattr, tronscan, '_batch_supported', None)
+
+    def _http(self, batch_reply):
+        def fake_http(url, params, timeout, headers=None):
+            self.calls.append(params)
+            if 'hashes' in params:
+                return batch_reply(params['hashes'].split(','))
+            return _Reply(200, dict(CONFIRMED, hash=params['hash']))
+        return mock.patch.object(tronscan, '_http_get', side_effect=fake_http)
+
+    def _multi(self):
+        return [c for c in self.calls if 'hashes' in c]
+
+    def _run(self, batch_reply):
+        hashes = [f'h{i}' for i in range(100)]
+        with self._http(batch_reply):
+            out = tronscan.fetch_costs_parallel(hashes, max_workers=8, debug=False)
+        self.assertEqual(set(out), set(hashes))
+        return self._multi()
+
+    def test_unsupported_backend_is_probed_once(self):
+        multi = self._run(lambda hs: _Reply(200, {}))
+        self.assertEqual(len(multi), 1)
+        self.assertIs(tronscan._batch_supported, False)
+        self.assertEqual(len(self.calls), 1 + 100)
+
+    def test_supported_backend_batches_every_group(self):
+        multi = self._run(lambda hs: _Reply(200, {'data': [dict(CONFIRMED, hash=h) for h in hs]}))
+        self.assertIs(tronscan._batch_supported, True)
+        self.assertEqual(len(multi), 100 // tronscan.COST_BATCH_SIZE)
+        self.assertEqual(len(self.calls), len(multi))
+
+    def test_legacy_throttle_keyword_warns_and_is_ignored(self):
+        with self._http(lambda hs: _Reply(200, {})), mock.patch('time.sleep') as sleep:
+            with self.assertWarns(DeprecationWarning):
+                out = tronscan.fetch_costs_parallel(['a', 'b'], max_workers=2, debug=False, throttle=0.25)
+        self.assertEqual(set(out), {'a', 'b'})
+        sleep.assert_not_called()
+
+    def test_transient_probe_failure_is_not_cached(self):
+        replies = [_Reply(429)]
+        def batch_reply(hs):
+            if replies:
+                return replies.pop()
+            return _Reply(200, {'data': [dict(CONFIRMED, hash=h) for h in hs]})
+        with self._http(batch_reply):
+            first = tronscan._fetch_tx_cost_batch(['a', 'b'])
+            self.assertIsNone(tronscan._batch_supported)
+            second = tronscan._fetch_tx_cost_batch(['c', 'd'])
+        self.assertIs(tronscan._batch_supported, True)
+        self.assertEqual([r['hash'] for r in first + second], ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(self._multi()), 2)
+
+    def test_concurrent_batches_share_one_probe(self):
+        def slow_unsupported(hs):
+            time.sleep(0.05)  # keep the probe in flight while the other workers arrive
+            return _Reply(200, {})
+        groups = [[f'g{g}h{i}' for i in range(5)] for g in range(8)]
+        with self._http(slow_unsupported), ThreadPoolExecutor(8) as ex:
+            list(ex.map(tronscan._fetch_tx_cost_batch, groups))
+        self.assertEqual(len(self._multi()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.utils import (  # noqa: E402
+    _empty_index, _index_intervals, covering_range, is_block_in_index,
+    make_chunk_filename, update_index_with_file,
+)
+
+
+class CoverageTest(unittest.TestCase):
+    def test_adjacent_chunks_form_one_run(self):
+        index = _empty_index()
+        for high, low in ((100, 97), (96, 95), (90, 80)):
+            index = update_index_with_file(index, make_chunk_filename(high, low))
+        self.assertEqual(covering_range(98, index), (100, 95))
+        self.assertEqual(covering_range(95, index), (100, 95))
+        self.assertIsNone(covering_range(94, index))
+        self.assertFalse(is_block_in_index(91, index))
+        self.assertTrue(is_block_in_index(80, index))
+
+    def test_incremental_runs_match_a_rebuild(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            index = update_index_with_file(_empty_index(), make_chunk_filename(120, 110))
+            self.assertEqual(covering_range(115, index), (120, 110))
+            self.assertIn('_intervals', index)  # the cache exists before the updates below
+            for _ in range(rng.randint(1, 30)):
+                low = rng.randint(0, 200)
+                high = low + rng.randint(0, 15)
+                index = update_index_with_file(index, make_chunk_filename(high, low))
+                self.assertIn('_intervals', index)  # folded in place, not invalidated
+            incremental = index.pop('_intervals')
+            self.assertEqual(incremental, _index_intervals(index))
+
+if __name__ == '__main__':
+    unittest.main()
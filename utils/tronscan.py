@@ -1,7 +1,14 @@
 import os
 import time
 import json
+import sqlite3
+import threading
+import warnings
+from collections import OrderedDict
+import orjson
+import polars as pl
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional, Tuple, Set
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -17,21 +24,148 @@ HTTP_PROXY = os.getenv('TRON_HTTP_PROXY') or PROXY_ALL or os.getenv('HTTP_PROXY'
 HTTPS_PROXY = os.getenv('TRON_HTTPS_PROXY') or PROXY_ALL or os.getenv('HTTPS_PROXY')
 PROXIES = {'http': HTTP_PROXY, 'https': HTTPS_PROXY} if (HTTP_PROXY or HTTPS_PROXY) else None
 HEADERS = {'Accept': 'application/json'}
+QPS = float(os.getenv('TRONSCAN_QPS', '9'))  # global request-start rate shared by all threads
 if API_KEY:
     HEADERS['TRON-PRO-API-KEY'] = API_KEY
 
+# Shared keep-alive session: one TLS handshake per host instead of per page.
+# One pool per base (x2 for the http/https mounts); pool_maxsize covers the cost and
+# window fan-out workers. Retries are done only by _get_single, since adapter-level
+# retries would multiply with its loop.
+_SESSION = requests.Session()
+_SESSION.headers.update(HEADERS)
+_SESSION.proxies.update({k: v for k, v in (PROXIES or {}).items() if v})
+_ADAPTER = HTTPAdapter(pool_connections=max(4, len(TRONSCAN_BASES) * 2), pool_maxsize=32,
+                       pool_block=False, max_retries=0)
+_SESSION.mount('https://', _ADAPTER)
+_SESSION.mount('http://', _ADAPTER)
+
+# Opt-in HTTP/2 (TRONSCAN_HTTP2=1, needs httpx[http2]): concurrent cost lookups share
+# multiplexed streams on one connection per host. Falls back to _SESSION when unavailable.
+USE_HTTP2 = os.getenv('TRONSCAN_HTTP2', '0') == '1'
+try:
+    import httpx
+except ImportError:
+    httpx = None
+_NET_ERRORS: Tuple[type, ...] = (requests.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+_CLIENT = None  # httpx.Client, created on first use so proxy/CA settings installed later apply
+_CLIENT_LOCK = threading.Lock()
+
+def _http2_client():
+    global _CLIENT, USE_HTTP2
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None and USE_HTTP2:
+                proxy = (PROXIES or {}).get('https') or (PROXIES or {}).get('http')
+                try:
+                    _CLIENT = httpx.Client(
+                        http2=True, headers=HEADERS, proxy=proxy, trust_env=False,
+                        verify=os.environ.get('REQUESTS_CA_BUNDLE') or True,
+                        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                    )
+                except (ImportError, AttributeError, TypeError) as e:  # no httpx / h2, or httpx too old
+                    print(f"[WARN][TRONSCAN] HTTP/2 client unavailable ({e}); using requests")
+                    USE_HTTP2 = False
+    return _CLIENT
+
+def _http_get(url: str, params: Dict[str, Any], timeout: int, headers: Optional[Dict[str, str]] = None):
+    """GET via the HTTP/2 client when enabled, else the shared requests session."""
+    client = _http2_client() if USE_HTTP2 else None
+    if client is not None:
+        return client.get(url, params=params, timeout=timeout, headers=headers)
+    # proxies is passed per call as well: with trust_env, environment proxies
+    # would otherwise take precedence over the session's
+    return _SESSION.get(url, params=params, timeout=timeout, proxies=PROXIES, headers=headers)
+
 # ---------------- HTTP helpers -----------------
 
+_RATE_LOCK = threading.Lock()
+_next_slot = 0.0  # monotonic time at which the next request may start
+# AIMD on the shared rate: halve on 429/5xx, add QPS/32 back per success, capped at QPS
+QPS_MIN = min(QPS, float(os.getenv('TRONSCAN_QPS_MIN', '1')))
+_cur_qps = QPS
+
+def _throttle() -> None:
+    """Space request starts 1/_cur_qps apart across all threads (slot reserved under the lock, slept outside)."""
+    global _next_slot
+    if QPS <= 0:
+        return
+    with _RATE_LOCK:
+        now = time.monotonic()
+        slot = max(now, _next_slot)
+        _next_slot = slot + 1.0 / _cur_qps
+    if slot > now:
+        time.sleep(slot - now)
+
+def _rate_feedback(ok: bool, debug: bool = False) -> None:
+    global _cur_qps
+    if QPS <= 0:
+        return
+    with _RATE_LOCK:
+        prev = _cur_qps
+        _cur_qps = min(QPS, prev + QPS / 32) if ok else max(QPS_MIN, prev / 2)
+    if debug and not ok and _cur_qps != prev:
+        print(f"[DEBUG][TRONSCAN] rate {prev:.2f} -> {_cur_qps:.2f} req/s")
+
+# Conditional GETs: when a base answers with ETag/Last-Modified, keep the validators and
+# body per (url, params) and revalidate with If-None-Match/If-Modified-Since; a 304 is
+# served from here. Nothing is stored for backends that send no validators.
+CONDITIONAL_GET = os.getenv('TRONSCAN_CONDITIONAL', '1') == '1'
+VALIDATOR_CACHE_SIZE = 1024
+_VALIDATORS: 'OrderedDict[tuple, Tuple[Optional[str], Optional[str], bytes]]' = OrderedDict()  # body serialized
+_VALIDATOR_LOCK = threading.Lock()
+
+def _conditional_headers(key: tuple) -> Optional[Dict[str, str]]:
+    with _VALIDATOR_LOCK:
+        hit = _VALIDATORS.get(key)
+    if hit is None:
+        return None
+    etag, last_modified, _ = hit
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def _remember_validators(key: tuple, r, data: Dict[str, Any]) -> None:
+    etag = r.headers.get('ETag'); last_modified = r.headers.get('Last-Modified')
+    if not (etag or last_modified) or not data:
+        return
+    with _VALIDATOR_LOCK:
+        _VALIDATORS[key] = (etag, last_modified, orjson.dumps(data))
+        _VALIDATORS.move_to_end(key)
+        while len(_VALIDATORS) > VALIDATOR_CACHE_SIZE:
+            _VALIDATORS.popitem(last=False)
+
 def _get_single(base: str, path: str, params: Dict[str, Any], *, timeout: int, retries: int, backoff: float, debug: bool) -> Dict[str, Any]:
     url = base.rstrip('/') + path
+    key = (url, tuple(sorted(params.items()))) if CONDITIONAL_GET else None
     for attempt in range(retries + 1):
         try:
-            r = requests.get(url, params=params, headers=HEADERS, timeout=timeout, proxies=PROXIES)
+            headers = _conditional_headers(key) if key is not None else None
+            _throttle()  # every request that goes on the wire, retries included, takes a slot
+            r = _http_get(url, params, timeout, headers)
+            if r.status_code in (200, 304):
+                _rate_feedback(True)
+            elif r.status_code == 429 or r.status_code >= 500:
+                _rate_feedback(False, debug)
+            if r.status_code == 304 and headers:
+                with _VALIDATOR_LOCK:
+                    hit = _VALIDATORS.get(key)
+                if hit is not None:
+                    if debug:
+                        print(f"[DEBUG][TRONSCAN] 304 not modified {url}")
+                    return orjson.loads(hit[2])
+                continue  # evicted meanwhile: retry unconditionally
             if r.status_code == 200:
                 try:
-                    return r.json() or {}
+                    data = r.json() or {}
                 except Exception:
                     return {}
+                if key is not None:
+                    _remember_validators(key, r, data)
+                return data
             if r.status_code == 429:
                 if debug:
                     print(f"[DEBUG][TRONSCAN] 429 {url} attempt={attempt}")
@@ -40,18 +174,58 @@ def _get_single(base: str, path: str, params: Dict[str, Any], *, timeout: int, r
                 if debug:
                     print(f"[DEBUG][TRONSCAN] HTTP {r.status_code} {url} attempt={attempt}")
                 time.sleep(backoff * (attempt + 1))
-        except requests.RequestException as e:
+        except _NET_ERRORS as e:
             if debug:
                 print(f"[DEBUG][TRONSCAN] net err {e} {url} attempt={attempt}")
             time.sleep(backoff * (attempt + 1))
     return {}
 
+# Short-lived response cache: identical GETs within one run (soft-failure re-tries,
+# overlapping windows, probes) are answered from memory.
+RESP_CACHE_TTL = float(os.getenv('TRONSCAN_CACHE_TTL', '60'))  # seconds; 0 disables
+RESP_CACHE_SIZE = 1024
+_RESP_CACHE: 'OrderedDict[tuple, Tuple[float, bytes]]' = OrderedDict()  # serialized: each hit is a fresh copy
+_RESP_LOCK = threading.Lock()
+
+def _cache_key(path: str, params: Dict[str, Any]) -> tuple:
+    return (path, tuple(sorted(params.items())))
+
+def _cache_lookup(key: tuple) -> Optional[Dict[str, Any]]:
+    with _RESP_LOCK:
+        hit = _RESP_CACHE.get(key)
+        if hit is None:
+            return None
+        if time.monotonic() - hit[0] >= RESP_CACHE_TTL:
+            del _RESP_CACHE[key]
+            return None
+        _RESP_CACHE.move_to_end(key)
+        body = hit[1]
+    return orjson.loads(body)
+
+def _cache_store(key: tuple, data: Dict[str, Any]) -> None:
+    if not data or (key[0] == '/api/transaction-info' and _tx_info_pending(data)):
+        return
+    with _RESP_LOCK:
+        _RESP_CACHE[key] = (time.monotonic(), orjson.dumps(data))
+        _RESP_CACHE.move_to_end(key)
+        while len(_RESP_CACHE) > RESP_CACHE_SIZE:
+            _RESP_CACHE.popitem(last=False)
+
 def _get(path: str, params: Dict[str, Any], *, timeout: int = 40, retries: int = 4, backoff: float = 0.6, debug: bool = False) -> Dict[str, Any]:
+    key = _cache_key(path, params) if RESP_CACHE_TTL > 0 else None
+    if key is not None:
+        cached = _cache_lookup(key)
+        if cached is not None:
+            if debug:
+                print(f"[DEBUG][TRONSCAN] cache hit path={path}")
+            return cached
     for idx, base in enumerate(TRONSCAN_BASES):
         data = _get_single(base, path, params, timeout=timeout, retries=retries, backoff=backoff, debug=debug)
         if data:
             if debug:
                 print(f"[DEBUG][TRONSCAN] success base={base}")
+            if key is not None:
+                _cache_store(key, data)
             return data
         if debug and idx < len(TRONSCAN_BASES)-1:
             print(f"[DEBUG][TRONSCAN] switching base ({idx+1}/{len(TRONSCAN_BASES)})")
@@ -59,229 +233,320 @@ def _get(path: str, params: Dict[str, Any], *, timeout: int = 40, retries: int =
 
 # ---------------- Core fetch (time window + paging) -----------------
 
-def fetch_transactions_interval(contract: str, start_ts_ms: int, end_ts_ms: int, *, limit: int, debug: bool) -> List[Dict[str, Any]]:
-    """Fetch all transactions where toAddress=contract & contractType=31 in [start_ts_ms,end_ts_ms] (ms).
-    Uses offset paging with start parameter. Returns raw list (no normalization)."""
+def _item_ts_ms(item: Dict[str, Any]) -> Optional[int]:
+    ts = item.get('block_ts') or item.get('timestamp') or item.get('time') or item.get('block_timestamp')
+    try:
+        ts = int(ts)
+    except (TypeError, ValueError):
+        return None
+    return ts * 1000 if ts < 10**12 else ts
+
+def _item_id(item: Dict[str, Any]) -> Any:
+    return item.get('transaction_id') or item.get('hash') or item.get('txID')
+
+def _keyset_interval(path: str, params: Dict[str, Any], keys: Tuple[str, ...], start_ts_ms: int, end_ts_ms: int, *,
+                     limit: int, debug: bool, label: str) -> List[Dict[str, Any]]:
+    """Collect every item in [start_ts_ms,end_ts_ms] newest->older with a timestamp cursor.
+
+    Each page re-queries with end_timestamp = oldest timestamp seen so far
+    (inclusive, since many transfers share a block timestamp) and start=0, so
+    the backend never scans past a growing offset. Items at the cursor
+    timestamp are deduped by id; a page made entirely of one timestamp falls
+    back to offset paging within it so the cursor always advances.
+    """
     out: List[Dict[str, Any]] = []
+    cursor = end_ts_ms
     offset = 0
+    at_cursor: Set[Any] = set()  # ids already returned whose timestamp == cursor
     page = 0
-    while True:
-        params = {
-            'sort': '-timestamp',
-            'count': 'true',
-            'limit': limit,
-            'start': offset,
-            'start_timestamp': start_ts_ms,
-            'end_timestamp': end_ts_ms,
-            'toAddress': contract,
-            'contractType': 31
-        }
-        data = _get('/api/transaction', params, debug=debug)
-        txs = data.get('data') if isinstance(data, dict) else None
-        if not isinstance(txs, list):
-            txs = []
+    while cursor >= start_ts_ms:
+        query = dict(params, limit=limit, start=offset, start_timestamp=start_ts_ms, end_timestamp=cursor)
+        items = _extract_list(path, _get(path, query, debug=debug), keys)
         if debug:
-            print(f"[DEBUG][TRONSCAN] interval page={page} off={offset} size={len(txs)} start_ts={start_ts_ms} end_ts={end_ts_ms}")
-        if not txs:
+            print(f"[DEBUG][TRONSCAN] {label} page={page} cursor={cursor} off={offset} size={len(items)} start={start_ts_ms}")
+        if not items:
             break
-        out.extend(txs)
-        if len(txs) < limit:
+        stamps = [_item_ts_ms(t) for t in items]
+        for t in items:
+            tid = _item_id(t)
+            if tid is not None and tid in at_cursor:
+                continue
+            out.append(t)
+        if len(items) < limit:
             break
-        offset += limit
+        known = [ts for ts in stamps if ts is not None]
+        oldest = min(known) if known else None
+        if oldest is None or oldest >= cursor:
+            offset += limit  # whole page at the cursor timestamp
+        else:
+            cursor, offset = oldest, 0
+            at_cursor = set()
+        at_cursor.update(_item_id(t) for t, ts in zip(items, stamps) if ts == cursor)
         page += 1
-        time.sleep(0.11)
     return out
 
+TX_LIST_KEYS = ('data',)
+TRANSFER_LIST_KEYS = ('token_transfers','trc20_transfers','trc20Transfers','data')
+_list_keys: Dict[str, str] = {}  # endpoint path -> key that held the item list last time
+
+def _extract_list(path: str, data: Any, keys: Tuple[str, ...], *, any_list: bool = False) -> List[Dict[str, Any]]:
+    """Item list of a TronScan response, trying the key that worked last time for path first.
+
+    any_list: fall back to the first list value when none of keys match.
+    """
+    if not isinstance(data, dict):
+        return []
+    key = _list_keys.get(path)
+    if key is not None:
+        items = data.get(key)
+        if isinstance(items, list):
+            return items
+    for k in keys:
+        items = data.get(k)
+        if isinstance(items, list):
+            _list_keys[path] = k
+            return items
+    if any_list:
+        for v in data.values():
+            if isinstance(v, list):
+                return v
+    return []
+
+def _fetch_page(path: str, params: Dict[str, Any], keys: Tuple[str, ...], *, debug: bool, label: str,
+                any_list: bool = False) -> List[Dict[str, Any]]:
+    """One page from path; the shared body of the fetch_*_page functions."""
+    items = _extract_list(path, _get(path, params, debug=debug), keys, any_list=any_list)
+    if debug:
+        window = f" start={params['start_timestamp']} end={params['end_timestamp']}" if 'start_timestamp' in params else ''
+        print(f"[DEBUG][TRONSCAN] {label} off={params.get('start')} size={len(items)}{window}")
+    return items
+
+def fetch_transactions_interval(contract: str, start_ts_ms: int, end_ts_ms: int, *, limit: int, debug: bool) -> List[Dict[str, Any]]:
+    """Fetch all transactions where toAddress=contract & contractType=31 in [start_ts_ms,end_ts_ms] (ms).
+    Uses keyset (timestamp cursor) paging. Returns raw list (no normalization)."""
+    params = {'sort': '-timestamp', 'count': 'true', 'toAddress': contract, 'contractType': 31}
+    return _keyset_interval('/api/transaction', params, TX_LIST_KEYS, start_ts_ms, end_ts_ms,
+                            limit=limit, debug=debug, label='interval')
+
 def fetch_trc20_transfers_interval(contract: str, start_ts_ms: int, end_ts_ms: int, *, limit: int, debug: bool) -> List[Dict[str, Any]]:
-    """Fetch all TRC20 transfers for a contract in [start_ts_ms,end_ts_ms] newest->older via offset paging."""
-    out: List[Dict[str, Any]] = []
-    offset = 0
-    page = 0
-    while True:
-        params = {
-            'contract_address': contract,
-            'start_timestamp': start_ts_ms,
-            'end_timestamp': end_ts_ms,
-            'sort': '-timestamp',
-            'limit': limit,
-            'start': offset,
-            'count': 'true'
-        }
-        data = _get('/api/token_trc20/transfers', params, debug=debug)
-        transfers = []
-        if isinstance(data, dict):
-            for key in ('token_transfers','trc20_transfers','trc20Transfers','data'):
-                if isinstance(data.get(key), list):
-                    transfers = data.get(key)  # type: ignore
-                    break
-        if debug:
-            print(f"[DEBUG][TRONSCAN] trc20 page={page} off={offset} size={len(transfers)} start={start_ts_ms} end={end_ts_ms}")
-        if not transfers:
-            break
-        out.extend(transfers)
-        if len(transfers) < limit:
-            break
-        offset += limit
-        page += 1
-        time.sleep(0.11)
-    return out
+    """Fetch all TRC20 transfers for a contract in [start_ts_ms,end_ts_ms] newest->older via keyset paging on block_ts."""
+    params = {'contract_address': contract, 'sort': '-timestamp', 'count': 'true'}
+    return _keyset_interval('/api/token_trc20/transfers', params, TRANSFER_LIST_KEYS, start_ts_ms, end_ts_ms,
+                            limit=limit, debug=debug, label='trc20')
+
+def fetch_windows_parallel(contract: str, windows: List[Tuple[int,int]], *, max_workers: int, limit: int,
+                           debug: bool, data_source: str = 'transfers') -> List[Dict[str, Any]]:
+    """Fetch several time windows concurrently (each keyset-paged on its own worker).
+
+    data_source is 'transfers' or 'transactions' as in fetch_tron. Results are
+    concatenated in the order of windows; the global _throttle keeps the
+    combined request rate at QPS.
+    """
+    fetch = fetch_trc20_transfers_interval if data_source == 'transfers' else fetch_transactions_interval
+    if len(windows) <= 1 or max_workers <= 1:
+        return [t for ws, we in windows for t in fetch(contract, ws, we, limit=limit, debug=debug)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as ex:
+        futures = [ex.submit(fetch, contract, ws, we, limit=limit, debug=debug) for ws, we in windows]
+        return [t for fut in futures for t in fut.result()]
 
 def fetch_trc20_transfers_page(contract: str, start_ts_ms: int, end_ts_ms: int, *, offset: int, limit: int, debug: bool) -> List[Dict[str, Any]]:
     """Fetch a single TRC20 transfers page for contract within time window using offset."""
-    params = {
-        'contract_address': contract,
-        'start_timestamp': start_ts_ms,
-        'end_timestamp': end_ts_ms,
-        'sort': '-timestamp',
-        'limit': limit,
-        'start': offset,
-        'count': 'true'
-    }
-    data = _get('/api/token_trc20/transfers', params, debug=debug)
-    transfers = []
-    if isinstance(data, dict):
-        for key in ('token_transfers','trc20_transfers','trc20Transfers','data'):
-            if isinstance(data.get(key), list):
-                transfers = data.get(key)  # type: ignore
-                break
-    if debug:
-        print(f"[DEBUG][TRONSCAN] trc20 single page off={offset} size={len(transfers)} start={start_ts_ms} end={end_ts_ms}")
-    return transfers
+    params = {'contract_address': contract, 'start_timestamp': start_ts_ms, 'end_timestamp': end_ts_ms,
+              'sort': '-timestamp', 'limit': limit, 'start': offset, 'count': 'true'}
+    return _fetch_page('/api/token_trc20/transfers', params, TRANSFER_LIST_KEYS, debug=debug, label='trc20 single page')
 
 def fetch_trc20_transfers_page_simple(contract: str, offset: int, *, limit: int, debug: bool) -> List[Dict[str, Any]]:
     """Fetch newest-first TRC20 transfers page for contract using plain offset (no time filters)."""
-    params = {
-        'contract_address': contract,
-        'sort': '-timestamp',
-        'limit': limit,
-        'start': offset,
-        'count': 'true'
-    }
-    data = _get('/api/token_trc20/transfers', params, debug=debug)
-    transfers: List[Dict[str, Any]] = []
-    if isinstance(data, dict):
-        for key in ('token_transfers','trc20_transfers','trc20Transfers','data'):
-            if isinstance(data.get(key), list):
-                transfers = data.get(key)  # type: ignore
-                break
-    if debug:
-        print(f"[DEBUG][TRONSCAN] simple page off={offset} size={len(transfers)}")
-    return transfers
+    params = {'contract_address': contract, 'sort': '-timestamp', 'limit': limit, 'start': offset, 'count': 'true'}
+    return _fetch_page('/api/token_trc20/transfers', params, TRANSFER_LIST_KEYS, debug=debug, label='simple page')
 
 def fetch_transactions_page_simple(contract: str, offset: int, *, limit: int, debug: bool) -> List[Dict[str, Any]]:
     """Fetch newest-first contract transactions via /api/transaction using contract_address (plain offset)."""
-    params = {
-        'contract_address': contract,
-        'sort': '-timestamp',
-        'limit': limit,
-        'start': offset,
-        'count': 'true'
-    }
-    data = _get('/api/transaction', params, debug=debug)
-    txs: List[Dict[str, Any]] = []
-    if isinstance(data, dict):
-        if isinstance(data.get('data'), list):
-            txs = data.get('data')  # type: ignore
-        else:
-            # Fallback: find first list value
-            for v in data.values():
-                if isinstance(v, list):
-                    txs = v  # type: ignore
-                    break
-    if debug:
-        print(f"[DEBUG][TRONSCAN] tx simple page off={offset} size={len(txs)}")
-    return txs
+    params = {'contract_address': contract, 'sort': '-timestamp', 'limit': limit, 'start': offset, 'count': 'true'}
+    return _fetch_page('/api/transaction', params, TX_LIST_KEYS, debug=debug, label='tx simple page', any_list=True)
 
 def fetch_transactions_page_window(contract: str, start_ts_ms: int, end_ts_ms: int, *, offset: int, limit: int, debug: bool) -> List[Dict[str, Any]]:
     """Fetch a single page of contract transactions within a time window using /api/transaction."""
-    params = {
-        'contract_address': contract,
-        'start_timestamp': start_ts_ms,
-        'end_timestamp': end_ts_ms,
-        'sort': '-timestamp',
-        'limit': limit,
-        'start': offset,
-        'count': 'true'
-    }
-    data = _get('/api/transaction', params, debug=debug)
-    txs: List[Dict[str, Any]] = []
-    if isinstance(data, dict) and isinstance(data.get('data'), list):
-        txs = data.get('data')  # type: ignore
-    elif isinstance(data, dict):
-        for v in data.values():
-            if isinstance(v, list):
-                txs = v  # type: ignore
-                break
-    if debug:
-        print(f"[DEBUG][TRONSCAN] window tx page off={offset} size={len(txs)} start={start_ts_ms} end={end_ts_ms}")
-    return txs
+    params = {'contract_address': contract, 'start_timestamp': start_ts_ms, 'end_timestamp': end_ts_ms,
+              'sort': '-timestamp', 'limit': limit, 'start': offset, 'count': 'true'}
+    return _fetch_page('/api/transaction', params, TX_LIST_KEYS, debug=debug, label='window tx page', any_list=True)
 
 # ---------------- Normalization -----------------
 
-def normalize_transactions(raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    norm: List[Dict[str, Any]] = []
+VECTOR_MIN_ROWS = 256  # below this, per-row Python beats building a Polars Series
+
+_DAY_PREFIX: Dict[int, str] = {}  # epoch day -> 'YYYY-MM-DDT' (one entry per day ever seen)
+
+def _iso_utc(ts_sec: List[int]) -> List[str]:
+    """datetime.fromtimestamp(t, utc).isoformat() for each t, vectorized for large inputs.
+
+    Small inputs format the date once per day and the time with divmod, so no
+    datetime object is built per row.
+    """
+    if len(ts_sec) < VECTOR_MIN_ROWS:
+        out: List[str] = []
+        for t in ts_sec:
+            day, sec = divmod(t, 86400)
+            prefix = _DAY_PREFIX.get(day)
+            if prefix is None:
+                prefix = _DAY_PREFIX[day] = datetime.fromtimestamp(day * 86400, tz=timezone.utc).strftime('%Y-%m-%dT')
+            h, rem = divmod(sec, 3600)
+            m, s = divmod(rem, 60)
+            out.append(f"{prefix}{h:02d}:{m:02d}:{s:02d}+00:00")
+        return out
+    return (pl.from_epoch(pl.Series(ts_sec, dtype=pl.Int64), time_unit='s')
+            .dt.to_string('%Y-%m-%dT%H:%M:%S+00:00').to_list())
+
+def _usdt_amounts(quants: List[Any]) -> List[Optional[float]]:
+    """int(quant) / 1e6 per value (None when missing or not an integer)."""
+    if len(quants) < VECTOR_MIN_ROWS:
+        out: List[Optional[float]] = []
+        for q in quants:
+            try:
+                out.append(int(q) / 1_000_000 if q is not None else None)
+            except Exception:
+                out.append(None)
+        return out
+    raw = pl.Series([None if q is None else str(q) for q in quants], dtype=pl.Utf8)
+    return (raw.cast(pl.Int64, strict=False) / 1_000_000).to_list()
+
+def _with_timestamps(raw: List[Dict[str, Any]], ts_keys: Tuple[str, ...]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """Copy each dict record with a parseable timestamp and add timestamp_ms/timeStamp."""
+    recs: List[Dict[str, Any]] = []
+    secs: List[int] = []
     for r in raw:
         if not isinstance(r, dict):
             continue
-        ts = r.get('timestamp') or r.get('time') or r.get('block_timestamp') or r.get('block_ts')
+        ts = None
+        for k in ts_keys:
+            ts = r.get(k)
+            if ts:
+                break
         try:
             ts = int(ts)
         except Exception:
             continue
         ts_ms = ts * 1000 if ts < 10**12 else ts
-        ts_sec = ts_ms // 1000
         rec = dict(r)
+        rec['timestamp_ms'] = ts_ms
+        rec['timeStamp'] = ts_ms // 1000
+        recs.append(rec)
+        secs.append(ts_ms // 1000)
+    return recs, secs
+
+def normalize_transactions(raw: List[Dict[str, Any]], include_iso: bool = False) -> List[Dict[str, Any]]:
+    """Records carry integer timestamp_ms/timeStamp; the ISO 'datetime' string only with include_iso."""
+    norm, secs = _with_timestamps(raw, ('timestamp', 'time', 'block_timestamp', 'block_ts'))
+    for rec in norm:
         if 'hash' not in rec:
             for k in ('transaction_id','txID'):
                 if k in rec:
                     rec['hash'] = rec.get(k)
                     break
-        rec['timestamp_ms'] = ts_ms
-        rec['timeStamp'] = ts_sec
-        rec['datetime'] = datetime.fromtimestamp(ts_sec, tz=timezone.utc).isoformat()
-        norm.append(rec)
+    if include_iso:
+        for rec, iso in zip(norm, _iso_utc(secs)):
+            rec['datetime'] = iso
     norm.sort(key=lambda x: x['timeStamp'], reverse=True)
     return norm
 
-def normalize_trc20_transfers(raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    norm: List[Dict[str, Any]] = []
-    for t in raw:
-        if not isinstance(t, dict):
-            continue
-        ts = t.get('block_ts') or t.get('timestamp') or t.get('time')
-        try:
-            ts = int(ts)
-        except Exception:
-            continue
-        if ts < 10**12:
-            ts_ms = ts * 1000
-        else:
-            ts_ms = ts
-        ts_sec = ts_ms // 1000
-        rec = dict(t)
+def normalize_trc20_transfers(raw: List[Dict[str, Any]], include_iso: bool = False) -> List[Dict[str, Any]]:
+    norm, secs = _with_timestamps(raw, ('block_ts', 'timestamp', 'time'))
+    # Amount from quant (USDT has 6 decimals)
+    amounts = _usdt_amounts([rec.get('quant') or rec.get('value') for rec in norm])
+    for rec, amount in zip(norm, amounts):
         txid = rec.get('transaction_id') or rec.get('hash') or rec.get('txID')
         if txid:
             rec['hash'] = txid
-        rec['timestamp_ms'] = ts_ms
-        rec['timeStamp'] = ts_sec
-        rec['datetime'] = datetime.fromtimestamp(ts_sec, tz=timezone.utc).isoformat()
-        # Amount from quant (USDT has 6 decimals)
-        quant = rec.get('quant') or rec.get('value')
-        try:
-            rec['amount_usdt'] = int(quant) / 1_000_000 if quant is not None else None
-        except Exception:
-            rec['amount_usdt'] = None
-        norm.append(rec)
+        rec['amount_usdt'] = amount
+    if include_iso:
+        for rec, iso in zip(norm, _iso_utc(secs)):
+            rec['datetime'] = iso
     norm.sort(key=lambda x: x['timeStamp'], reverse=True)
     return norm
 
 # ---------------- Cost retrieval -----------------
 COST_FIELDS = ['fee','energy_fee','net_fee','energy_usage_total','energy_usage','net_usage','energy_penalty_total','energy_penalty_usage','energy_penalty_fee']
 
-def fetch_tx_cost(hash_: str, *, debug: bool = False) -> Dict[str, Any]:
+# Confirmed tx costs never change: keep them in a bounded in-process LRU backed by a
+# sqlite file (hash -> JSON), so repeated enrichment runs skip the HTTP round-trip.
+COST_CACHE_PATH = os.getenv('TRON_COST_CACHE', os.path.join('transactions_tron', 'tx_cost_cache.sqlite'))
+COST_MEMO_SIZE = 65536
+COST_DB_BATCH = 100  # rows per write-back in fetch_costs_parallel
+
+_COST_MEMO: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_COST_LOCK = threading.Lock()  # guards _COST_MEMO and the shared sqlite connection
+_cost_conn: Optional[sqlite3.Connection] = None
+
+def _cost_db() -> Optional[sqlite3.Connection]:
+    global _cost_conn
+    if _cost_conn is None and COST_CACHE_PATH:
+        try:
+            os.makedirs(os.path.dirname(COST_CACHE_PATH) or '.', exist_ok=True)
+            conn = sqlite3.connect(COST_CACHE_PATH, check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS tx_cost (hash TEXT PRIMARY KEY, data BLOB NOT NULL)')
+            _cost_conn = conn
+        except sqlite3.Error as e:
+            print(f"[WARN][TRONSCAN] cost cache disabled: {e}")
+    return _cost_conn
+
+def _memo_put(hash_: str, cost: Dict[str, Any]) -> None:
+    _COST_MEMO[hash_] = cost
+    _COST_MEMO.move_to_end(hash_)
+    if len(_COST_MEMO) > COST_MEMO_SIZE:
+        _COST_MEMO.popitem(last=False)
+
+def _cached_costs(hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Return the cached costs among hashes (memo first, then one sqlite lookup per 500)."""
+    found: Dict[str, Dict[str, Any]] = {}
+    with _COST_LOCK:
+        missing = []
+        for h in hashes:
+            c = _COST_MEMO.get(h)
+            if c is None:
+                missing.append(h)
+            else:
+                found[h] = dict(c)
+        conn = _cost_db() if missing else None
+        if conn is not None:
+            for i in range(0, len(missing), 500):
+                part = missing[i:i+500]
+                rows = conn.execute(
+                    f"SELECT hash, data FROM tx_cost WHERE hash IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for h, blob in rows:
+                    c = orjson.loads(blob)
+                    _memo_put(h, c)
+                    found[h] = dict(c)
+    return found
+
+def _store_costs(costs: List[Dict[str, Any]]) -> None:
+    """Cache final (non-pending) cost records in memory and on disk."""
+    final = [c for c in costs if not c.get('cost_pending')]
+    if not final:
+        return
+    with _COST_LOCK:
+        for c in final:
+            _memo_put(c['hash'], dict(c))
+        conn = _cost_db()
+        if conn is not None:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO tx_cost (hash, data) VALUES (?, ?)',
+                                 [(c['hash'], orjson.dumps(c)) for c in final])
+
+def _fetch_tx_cost_uncached(hash_: str, *, debug: bool = False) -> Dict[str, Any]:
     params = {'hash': hash_}
     data = _get('/api/transaction-info', params, debug=debug)
-    if not data:
+    return _cost_record(hash_, data)
+
+def _tx_info_pending(data: Dict[str, Any]) -> bool:
+    """True when a transaction-info reply (single or multi-hash) still has unconfirmed costs."""
+    items = data['data'] if isinstance(data.get('data'), list) else [data]
+    return any(isinstance(item, dict) and (item.get('confirmed') is False
+                                           or not (item.get('cost') or item.get('receipt')))
+               for item in items)
+
+def _cost_record(hash_: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    if not data or _tx_info_pending(data):
         return {'hash': hash_, 'cost_pending': 1}
     cost = data.get('cost') or {}
     receipt = data.get('receipt') or {}
@@ -295,28 +560,150 @@ def fetch_tx_cost(hash_: str, *, debug: bool = False) -> Dict[str, Any]:
     out['contract_ret'] = data.get('contractRet') or cost.get('result')
     return out
 
-def fetch_costs_parallel(hashes: List[str], *, max_workers: int, debug: bool, throttle: float = 0.25) -> Dict[str, Dict[str, Any]]:
+COST_BATCH_SIZE = int(os.getenv('TRON_COST_BATCH', '20'))  # hashes per multi-hash request
+_batch_supported: Optional[bool] = None  # learned by one probe; False -> single-hash requests only
+_BATCH_PROBE_LOCK = threading.Lock()
+
+def _multi_hash_records(hashes: List[str], data: Any) -> Dict[str, Dict[str, Any]]:
+    items = data.get('data') if isinstance(data, dict) else None
+    by_hash: Dict[str, Dict[str, Any]] = {}
+    if isinstance(items, list):
+        wanted = set(hashes)
+        for item in items:
+            h = item.get('hash') if isinstance(item, dict) else None
+            if h in wanted:
+                by_hash[h] = _cost_record(h, item)
+    return by_hash
+
+def _multi_hash_costs(hashes: List[str], *, debug: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Cost records answered by one comma-separated 'hashes' request, keyed by hash."""
+    data = _get('/api/transaction-info', {'hashes': ','.join(hashes)}, debug=debug)
+    return _multi_hash_records(hashes, data)
+
+def _probe_multi_hash(hashes: List[str], *, debug: bool = False) -> Tuple[Optional[bool], Dict[str, Dict[str, Any]]]:
+    """One un-retried multi-hash request per base: (verdict, records).
+
+    verdict is True when a base answers with records, False on a definitive
+    reply without them (200 or other 4xx), None when every base failed
+    transiently (network error, timeout, 429, 5xx).
+    """
+    params = {'hashes': ','.join(hashes)}
+    verdict: Optional[bool] = None
+    for base in TRONSCAN_BASES:
+        url = base.rstrip('/') + '/api/transaction-info'
+        try:
+            _throttle()
+            r = _http_get(url, params, 40)
+        except _NET_ERRORS as e:
+            if debug:
+                print(f"[DEBUG][TRONSCAN] batch probe net err {e} {url}")
+            continue
+        if r.status_code == 429 or r.status_code >= 500:
+            _rate_feedback(False, debug)
+            if debug:
+                print(f"[DEBUG][TRONSCAN] batch probe HTTP {r.status_code} {url}")
+            continue
+        _rate_feedback(True)
+        try:
+            data = r.json() if r.status_code == 200 else None
+        except Exception:
+            data = None
+        by_hash = _multi_hash_records(hashes, data)
+        if by_hash:
+            return True, by_hash
+        verdict = False
+    return verdict, {}
+
+def _probe_batch_support(hashes: List[str], *, debug: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Decide _batch_supported with a multi-hash probe; returns the records it yielded.
+
+    Concurrent callers wait on the lock and then see the verdict. Only a
+    definitive reply settles it: after transient failures it stays None and the
+    next batch probes again. The probe does not retry, so each attempt costs
+    one round-trip per base.
+    """
+    global _batch_supported
+    with _BATCH_PROBE_LOCK:
+        if _batch_supported is not None:
+            return {}
+        verdict, by_hash = _probe_multi_hash(hashes, debug=debug)
+        _batch_supported = verdict
+        if debug and verdict is False:
+            print("[DEBUG][TRONSCAN] multi-hash transaction-info unsupported; using single-hash lookups")
+        elif debug and verdict is None:
+            print("[DEBUG][TRONSCAN] multi-hash probe failed transiently; will probe again")
+        return by_hash
+
+def _fetch_tx_cost_batch(hashes: List[str], *, debug: bool = False) -> List[Dict[str, Any]]:
+    """Cost records for several hashes, with one multi-hash request when the backend supports it.
+
+    Hashes the backend does not answer for are fetched one by one.
+    """
+    by_hash: Dict[str, Dict[str, Any]] = {}
+    if len(hashes) > 1:
+        if _batch_supported is None:
+            by_hash = _probe_batch_support(hashes, debug=debug)
+        if not by_hash and _batch_supported:
+            by_hash = _multi_hash_costs(hashes, debug=debug)
+    return [by_hash[h] if h in by_hash else _fetch_tx_cost_uncached(h, debug=debug) for h in hashes]
+
+def fetch_tx_cost(hash_: str, *, debug: bool = False) -> Dict[str, Any]:
+    cached = _cached_costs([hash_])
+    if hash_ in cached:
+        return cached[hash_]
+    out = _fetch_tx_cost_uncached(hash_, debug=debug)
+    _store_costs([out])
+    return out
+
+def fetch_costs_parallel(hashes: List[str], *, max_workers: int, debug: bool,
+                         throttle: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """Cost records for hashes: cache hits first, misses fetched on max_workers threads.
+
+    Request pacing is the global _throttle (TRONSCAN_QPS), applied per HTTP call
+    inside the workers; results are collected without any main-thread delay.
+    throttle is accepted for older callers and ignored.
+    """
+    if throttle is not None:
+        warnings.warn("fetch_costs_parallel(throttle=...) is ignored; pacing comes from TRONSCAN_QPS",
+                      DeprecationWarning, stacklevel=2)
     hashes = [h for h in dict.fromkeys(hashes)]
-    results: Dict[str, Dict[str, Any]] = {}
+    results: Dict[str, Dict[str, Any]] = _cached_costs(hashes) if hashes else {}
+    hashes = [h for h in hashes if h not in results]
+    if debug and results:
+        print(f"[DEBUG][TRONSCAN] cost cache hits={len(results)} misses={len(hashes)}")
     if not hashes:
         return results
     if len(hashes) <= 3:
         for h in hashes:
-            results[h] = fetch_tx_cost(h, debug=debug)
-            time.sleep(throttle)
+            results[h] = _fetch_tx_cost_uncached(h, debug=debug)
+        _store_costs([results[h] for h in hashes])
         return results
+    pending_rows: List[Dict[str, Any]] = []
+    groups = [hashes[i:i+COST_BATCH_SIZE] for i in range(0, len(hashes), max(1, COST_BATCH_SIZE))]
+    if _batch_supported is None and len(groups[0]) > 1:
+        # Settle multi-hash support on the first group before fanning out, so
+        # workers neither all probe at once nor wait on the probe lock
+        first = _fetch_tx_cost_batch(groups.pop(0), debug=debug)
+        for res in first:
+            results[res['hash']] = res
+        pending_rows.extend(first)
     with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        fut_map = {ex.submit(fetch_tx_cost, h, debug=debug): h for h in hashes}
+        fut_map = {ex.submit(_fetch_tx_cost_batch, g, debug=debug): g for g in groups}
         for fut in as_completed(fut_map):
-            h = fut_map[fut]
+            group = fut_map[fut]
             try:
-                res = fut.result()
+                rows = fut.result()
             except Exception as e:
                 if debug:
-                    print(f"[DEBUG][TRONSCAN] cost error {h} {e}")
-                res = {'hash': h, 'cost_pending': 1}
-            results[h] = res
-            time.sleep(throttle)
+                    print(f"[DEBUG][TRONSCAN] cost error {group[0]}..({len(group)}) {e}")
+                rows = [{'hash': h, 'cost_pending': 1} for h in group]
+            for res in rows:
+                results[res['hash']] = res
+            pending_rows.extend(rows)
+            if len(pending_rows) >= COST_DB_BATCH:
+                _store_costs(pending_rows)
+                pending_rows = []
+    _store_costs(pending_rows)
     return results
 
 # ---------------- Enrichment -----------------
@@ -365,7 +752,13 @@ def test_connectivity(contract: str, debug: bool = False) -> Tuple[bool, str]:
     # Empty could be rate limit / auth / window no transfers; treat as soft fail
     return False, 'no_data'
 
-# Proxy setter for runtime injection
+# Proxy setter for runtime injection (takes effect on the shared session's next request)
 def set_external_proxies(proxies: Dict[str, str]):
-    global PROXIES
+    global PROXIES, _CLIENT
     PROXIES = proxies
+    _SESSION.proxies.clear()
+    _SESSION.proxies.update(proxies or {})
+    with _CLIENT_LOCK:  # httpx binds proxies at construction; rebuild on next request
+        if _CLIENT is not None:
+            _CLIENT.close()
+            _CLIENT = None
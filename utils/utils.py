@@ -4,15 +4,18 @@ robust I/O for large-scale token transaction harvesting.
 
 Simplified & hardened:
 - Unified index schema (files/global/merged)
-- Robust CSV append that auto-removes header (works for polars returning str or bytes)
+- CSV append that writes the header only once, streamed straight to the file
 - Convenience helpers for chunk naming & coverage checks
 """
 from __future__ import annotations
 import os
-import json
+import re
+import mmap
+from bisect import bisect_left, bisect_right
 import tempfile
 from pathlib import Path
 from typing import Dict, Tuple, Optional, Iterable
+import orjson
 import polars as pl
 from datetime import datetime, timezone
 
@@ -21,15 +24,38 @@ from datetime import datetime, timezone
 # --------------------------------------------------------------------------------------
 
 def _empty_index() -> Dict:
-    return {"files": {}, "global": {"min": None, "max": None}, "merged": {"min": None, "max": None, "files": []}}
+    return {"files": {}, "global": {"min": None, "max": None}, "merged": {"min": None, "max": None, "files": {}}}
+
+def _journal_path(index_path: str | Path) -> Path:
+    return Path(index_path).with_suffix('.jsonl')
 
 def load_index(index_path: str | Path) -> Dict:
-    index_path = Path(index_path)
+    """Load the consolidated index, then replay any entries journaled since its last save."""
+    index = _load_index_json(Path(index_path))
+    journal = _journal_path(index_path)
+    if journal.exists():
+        with journal.open('rb') as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # torn tail line from an interrupted append
+                index = update_index_with_file(index, entry['file'], entry.get('ts_min'), entry.get('ts_max'))
+    return index
+
+def _read_json_mmap(path: Path):
+    """Parse a JSON file straight from a read-only mapping (no intermediate bytes copy)."""
+    with path.open('rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"empty file {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+def _load_index_json(index_path: Path) -> Dict:
     if not index_path.exists():
         return _empty_index()
     try:
-        with index_path.open('r') as f:
-            data = json.load(f)
+        data = _read_json_mmap(index_path)
         if 'files' not in data:  # legacy flat form
             files = data
             lows = [v['low'] for v in files.values()]
@@ -37,12 +63,14 @@ def load_index(index_path: str | Path) -> Dict:
             data = {
                 'files': files,
                 'global': {'min': min(lows) if lows else None, 'max': max(highs) if highs else None},
-                'merged': {'min': None, 'max': None, 'files': []}
+                'merged': {'min': None, 'max': None, 'files': {}}
             }
         data.setdefault('files', {})
         data.setdefault('global', {'min': None, 'max': None})
-        data.setdefault('merged', {'min': None, 'max': None, 'files': []})
-        data['merged'].setdefault('files', [])
+        data.setdefault('merged', {'min': None, 'max': None, 'files': {}})
+        merged_files = data['merged'].setdefault('files', {})
+        if isinstance(merged_files, list):  # legacy: bare list of merged filenames
+            data['merged']['files'] = {n: _file_range(data, n) for n in merged_files}
         return data
     except Exception:
         return _empty_index()
@@ -52,54 +80,139 @@ def save_index(index_path: str | Path, index: Dict) -> None:
     index_path.parent.mkdir(parents=True, exist_ok=True)
     tmp_fd, tmp_name = tempfile.mkstemp(prefix='idx_', suffix='.json', dir=str(index_path.parent))
     try:
-        with os.fdopen(tmp_fd, 'w') as f:
-            json.dump(index, f, indent=2)
+        # Drop in-memory caches (underscore keys) before serializing
+        data = {k: v for k, v in index.items() if not k.startswith('_')}
+        data['merged'] = {k: v for k, v in index['merged'].items() if not k.startswith('_')}
+        with os.fdopen(tmp_fd, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
         os.replace(tmp_name, index_path)
     except Exception as e:
         print(f"Warning: Could not save index: {e}")
         try: os.unlink(tmp_name)
         except OSError: pass
+        return
+    # Consolidated index now holds every journaled entry
+    try: _journal_path(index_path).unlink()
+    except FileNotFoundError: pass
+
+def append_index_journal(index_path: str | Path, filename: str, high: int, low: int,
+                         ts_min: int | None = None, ts_max: int | None = None) -> None:
+    """Append one chunk entry to the index journal (index.jsonl next to index.json).
+
+    Cheap per-chunk alternative to save_index; load_index replays the journal.
+    """
+    journal = _journal_path(index_path)
+    journal.parent.mkdir(parents=True, exist_ok=True)
+    entry = {'file': filename, 'high': high, 'low': low}
+    if ts_min is not None:
+        entry.update(ts_min=ts_min, ts_max=ts_max)
+    with journal.open('ab') as f:
+        f.write(orjson.dumps(entry) + b'\n')
+
+CHUNK_SUFFIXES = ('.parquet', '.csv')  # parquet is written by the fetcher, csv is legacy
+
+_CHUNK_NAME_RE = re.compile(r'(\d+)_(\d+)(?:' + '|'.join(re.escape(s) for s in CHUNK_SUFFIXES) + r')')
 
 def parse_block_range_from_filename(filename: str) -> Tuple[Optional[int], Optional[int]]:
-    base = Path(filename).name.replace('.csv', '')
-    parts = base.split('_')
-    if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
-        return int(parts[0]), int(parts[1])
-    return None, None
+    m = _CHUNK_NAME_RE.fullmatch(os.path.basename(filename))
+    if m is None: return None, None
+    return int(m.group(1)), int(m.group(2))
+
+def make_chunk_filename(high: int, low: int, suffix: str = '.parquet') -> str:
+    """Name a chunk file covering blocks high..low.
 
-def make_chunk_filename(high: int, low: int) -> str:
-    return f"{high}_{low}.csv"
+    Anything that pl.concat()s frames before writing a chunk (or a consolidated
+    file) must .rechunk() first: writing a frame made of many small chunks is
+    orders of magnitude slower than writing one contiguous chunk.
+    """
+    return f"{high}_{low}{suffix}"
 
-def update_index_with_file(index: Dict, filename: str) -> Dict:
+def update_index_with_file(index: Dict, filename: str, ts_min: int | None = None, ts_max: int | None = None) -> Dict:
+    """Record a chunk's block range (and timeStamp extremes, if known) in the index."""
     high, low = parse_block_range_from_filename(filename)
     if high is None: return index
-    index['files'][filename] = {'high': high, 'low': low}
+    entry = {'high': high, 'low': low}
+    prev = index['files'].get(filename)
+    if ts_min is not None:
+        entry.update(ts_min=int(ts_min), ts_max=int(ts_max))
+    elif prev and 'ts_min' in prev:  # re-registration (e.g. by the merger) keeps known extremes
+        entry.update(ts_min=prev['ts_min'], ts_max=prev['ts_max'])
+    index['files'][filename] = entry
+    cached = index.get('_intervals')
+    if cached is not None:
+        if prev is None:
+            _add_interval(cached, low, high)
+        elif (prev['low'], prev['high']) != (low, high):
+            index.pop('_intervals')  # range replaced; rebuilt lazily by covering_range
     gmin = index['global']['min']; gmax = index['global']['max']
     index['global']['min'] = low if gmin is None else min(gmin, low)
     index['global']['max'] = high if gmax is None else max(gmax, high)
     return index
 
+def _file_range(index: Dict, filename: str) -> Dict:
+    """{'high', 'low'} of a chunk, from the index when known, else parsed from its name."""
+    entry = index['files'].get(filename)
+    if entry is not None:
+        return {'high': entry['high'], 'low': entry['low']}
+    high, low = parse_block_range_from_filename(filename)
+    return {'high': high, 'low': low}
+
 def mark_files_merged(index: Dict, filenames: Iterable[str]) -> Dict:
     names = list(filenames)
     if not names: return index
-    lows = [index['files'][n]['low'] for n in names if n in index['files']]
-    highs = [index['files'][n]['high'] for n in names if n in index['files']]
+    merged_files = index['merged']['files']
+    ranges = [merged_files.setdefault(n, _file_range(index, n)) for n in names]
+    lows = [r['low'] for r in ranges if r['low'] is not None]
+    highs = [r['high'] for r in ranges if r['high'] is not None]
     if lows and highs:
         cur_min = index['merged']['min']; cur_max = index['merged']['max']
         index['merged']['min'] = min(lows) if cur_min is None else min(cur_min, min(lows))
         index['merged']['max'] = max(highs) if cur_max is None else max(cur_max, max(highs))
-    merged_set = set(index['merged']['files'])
-    merged_set.update(names)
-    index['merged']['files'] = sorted(merged_set)
     return index
 
-def is_block_in_index(block: int, index: Dict) -> bool:
+def merged_file_set(index: Dict):
+    """Names of merged chunk files (a live keys view of index['merged']['files'])."""
+    return index['merged']['files'].keys()
+
+def _index_intervals(index: Dict) -> Tuple[list, list]:
+    """Disjoint (lows, highs) coverage lists sorted by low, cached on the index (not persisted)."""
+    cached = index.get('_intervals')
+    if cached is None:
+        lows: list = []; highs: list = []
+        for lo, hi in sorted((m['low'], m['high']) for m in index['files'].values()):
+            if highs and lo <= highs[-1] + 1:
+                highs[-1] = max(highs[-1], hi)
+            else:
+                lows.append(lo); highs.append(hi)
+        cached = index['_intervals'] = (lows, highs)
+    return cached
+
+def _add_interval(cached: Tuple[list, list], lo: int, hi: int) -> None:
+    """Fold [lo, hi] into the cached coverage lists in place, merging touching runs."""
+    lows, highs = cached
+    j = bisect_left(highs, lo - 1)   # first run ending at or after lo-1
+    k = bisect_right(lows, hi + 1)   # past the last run starting at or before hi+1
+    if j < k:
+        lo = min(lo, lows[j]); hi = max(hi, highs[k - 1])
+    lows[j:k] = [lo]; highs[j:k] = [hi]
+
+def covering_range(block: int, index: Dict) -> Optional[Tuple[int, int]]:
+    """(high, low) of the merged coverage run containing block, else None.
+
+    Overlapping and adjacent chunks form one run; update_index_with_file keeps
+    the cached runs current, so this can be called between registrations.
+    """
     gmin = index['global']['min']; gmax = index['global']['max']
-    if gmin is None or gmax is None: return False
-    if block < gmin or block > gmax: return False
-    for meta in index['files'].values():
-        if meta['low'] <= block <= meta['high']: return True
-    return False
+    if gmin is None or gmax is None: return None
+    if block < gmin or block > gmax: return None
+    lows, highs = _index_intervals(index)
+    i = bisect_right(lows, block) - 1
+    if i >= 0 and block <= highs[i]:
+        return highs[i], lows[i]
+    return None
+
+def is_block_in_index(block: int, index: Dict) -> bool:
+    return covering_range(block, index) is not None
 
 def get_index_extremes(index: Dict) -> Tuple[Optional[int], Optional[int]]:
     return index['global']['min'], index['global']['max']
@@ -108,64 +221,117 @@ def get_index_extremes(index: Dict) -> Tuple[Optional[int], Optional[int]]:
 # Directory scan (metadata only)
 # --------------------------------------------------------------------------------------
 
+def iter_chunk_names(dir_path: str | Path) -> Iterable[str]:
+    """Yield chunk file names (parquet or legacy csv) in dir_path, via one scandir pass."""
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.name.endswith(CHUNK_SUFFIXES) and entry.is_file():
+                yield entry.name
+
+def scan_chunk(path: str | Path) -> pl.LazyFrame:
+    """Lazily scan a chunk file so projections/aggregations touch only needed columns."""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        return pl.scan_parquet(path)
+    return pl.scan_csv(path, schema_overrides={'timeStamp': pl.Int64}, low_memory=True)
+
+def binary_to_hex(frame: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    """Render Binary columns (hex-decoded addresses in parquet chunks) back as '0x...' strings."""
+    schema = frame.collect_schema() if isinstance(frame, pl.LazyFrame) else frame.schema
+    return frame.with_columns(
+        pl.concat_str([pl.lit('0x'), pl.col(name).bin.encode('hex')]).alias(name)
+        for name, dtype in schema.items() if dtype == pl.Binary
+    )
+
 def quick_scan_transaction_dir(dir_path: str | Path) -> Tuple[Optional[int], Optional[int], int]:
     dir_path = Path(dir_path)
     if not dir_path.exists(): return None, None, 0
-    lows, highs = [], []
-    for f in dir_path.glob('*.csv'):
-        h,l = parse_block_range_from_filename(f.name)
-        if h is not None:
-            highs.append(h); lows.append(l)
-    if not lows: return None, None, 0
-    return min(lows), max(highs), len(lows)
+    # scandir names are already basenames: match the compiled pattern directly
+    # instead of going through parse_block_range_from_filename per entry
+    match = _CHUNK_NAME_RE.fullmatch
+    ranges = [m.groups() for m in map(match, iter_chunk_names(dir_path)) if m is not None]
+    if not ranges: return None, None, 0
+    return min(int(l) for _, l in ranges), max(int(h) for h, _ in ranges), len(ranges)
+
+def rebuild_index_from_directory(dir_path: str | Path, base: Dict | None = None) -> Dict:
+    """Rebuild the per-file index from chunk filenames alone (one directory listing).
+
+    Chunk names encode their block range, so this recovers the index after a
+    crash or for a pre-existing directory. The 'merged' section is kept from base.
+    """
+    index = _empty_index()
+    if base is not None:
+        index['merged'] = base.get('merged', index['merged'])
+    dir_path = Path(dir_path)
+    if not dir_path.exists(): return index
+    for name in iter_chunk_names(dir_path):
+        index = update_index_with_file(index, name)
+    return index
 
 # --------------------------------------------------------------------------------------
 # Robust CSV write / append
 # --------------------------------------------------------------------------------------
 
+def append_parquet(df: pl.DataFrame, dir_path: str | Path, high: int, low: int) -> str:
+    """Add df to dir_path as the zstd Parquet chunk {high}_{low}.parquet; returns the filename.
+
+    Written to a temp file and renamed, so a crash never leaves a torn chunk
+    that later scans would trip over. Footer statistics let min/max
+    queries on the chunk skip the data pages.
+    """
+    dir_path = Path(dir_path); dir_path.mkdir(parents=True, exist_ok=True)
+    filename = make_chunk_filename(high, low)
+    path = dir_path / filename
+    tmp = path.with_name(filename + '.tmp')
+    df.rechunk().write_parquet(tmp, compression='zstd', compression_level=3, statistics=True)
+    os.replace(tmp, path)
+    return filename
+
 def append_dataframe(df: pl.DataFrame, path: str | Path, column_order: list[str] | None = None):
-    """Append DataFrame to CSV ensuring header only once (handles str/bytes return)."""
+    """Append DataFrame to CSV ensuring header only once (streamed straight to the file)."""
     path = Path(path); path.parent.mkdir(parents=True, exist_ok=True)
     if column_order:
         cols = [c for c in column_order if c in df.columns]
         df = df.select(cols)
-    data = df.write_csv(None)  # may be str or bytes depending on polars version
-    if isinstance(data, str):
-        first_newline = data.find('\n')
-        if first_newline == -1: return
-        if not path.exists():
-            with path.open('w', encoding='utf-8', newline='') as f: f.write(data)
-        else:
-            with path.open('a', encoding='utf-8', newline='') as f: f.write(data[first_newline+1:])
-    else:  # bytes
-        first_newline = data.find(b'\n')
-        if first_newline == -1: return
-        if not path.exists():
-            with path.open('wb') as f: f.write(data)
-        else:
-            with path.open('ab') as f: f.write(data[first_newline+1:])
+    header_needed = not path.exists() or path.stat().st_size == 0
+    with path.open('ab') as f:
+        df.write_csv(f, include_header=header_needed)
 
 # --------------------------------------------------------------------------------------
 # Stats / reporting
 # --------------------------------------------------------------------------------------
 
 def print_overall_transaction_dates(transactions_dir: str = 'transactions') -> None:
+    """Print the oldest/newest transaction dates in transactions_dir.
+
+    Uses the ts_min/ts_max recorded per chunk in the index; only chunks
+    without recorded extremes (written before they were tracked) are scanned.
+    """
     try:
         dir_path = Path(transactions_dir)
         if not dir_path.exists():
             print("No transactions directory found."); return
-        candidates = []
-        for f in dir_path.glob('*.csv'):
-            h,l = parse_block_range_from_filename(f.name)
-            if h is not None: candidates.append((l,h,f))
-        if not candidates:
+        files = load_index(dir_path / 'index.json')['files']
+        ts_mins, ts_maxs, candidates = [], [], []
+        for name in iter_chunk_names(dir_path):
+            entry = files.get(name)
+            if entry is not None and 'ts_min' in entry:
+                ts_mins.append(entry['ts_min']); ts_maxs.append(entry['ts_max'])
+                continue
+            h,l = parse_block_range_from_filename(name)
+            if h is not None: candidates.append((l,h,dir_path / name))
+        if not ts_mins and not candidates:
             print("No transaction chunk files found."); return
-        oldest_file = min(candidates, key=lambda x: x[0])[2]
-        newest_file = max(candidates, key=lambda x: x[1])[2]
-        oldest_df = pl.read_csv(oldest_file, columns=['timeStamp'])
-        newest_df = pl.read_csv(newest_file, columns=['timeStamp'])
-        oldest_ts = int(oldest_df['timeStamp'].min())
-        newest_ts = int(newest_df['timeStamp'].max())
+        if candidates:
+            oldest_file = min(candidates, key=lambda x: x[0])[2]
+            newest_file = max(candidates, key=lambda x: x[1])[2]
+            oldest, newest = pl.collect_all([
+                scan_chunk(oldest_file).select(pl.col('timeStamp').min()),
+                scan_chunk(newest_file).select(pl.col('timeStamp').max()),
+            ])
+            ts_mins.append(int(oldest.item())); ts_maxs.append(int(newest.item()))
+        oldest_ts = min(ts_mins)
+        newest_ts = max(ts_maxs)
         print(f"Oldest transaction date: {datetime.fromtimestamp(oldest_ts, tz=timezone.utc)}")
         print(f"Newest transaction date: {datetime.fromtimestamp(newest_ts, tz=timezone.utc)}")
     except Exception as e: